@@ -1,6 +1,6 @@
-import pkg_resources
+from importlib.metadata import version
 
-__version__ = pkg_resources.get_distribution(__name__).version
+__version__ = version(__name__)
 
 from .config import Config
 from .machine import MachineManager
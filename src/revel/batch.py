@@ -0,0 +1,34 @@
+"""Parsing of revel batch files.
+
+Each line holds a revel command, either as shell words (`create default`) or
+as JSON lines, an array of arguments (`["create", "default"]`) or an object
+with them under "args". Blank lines and lines starting with # are skipped.
+"""
+
+import json
+import shlex
+
+
+def parse(text: str) -> list[list[str]]:
+    commands = []
+    for number, line in enumerate(text.splitlines(), start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+
+        if line.startswith(("[", "{")):
+            try:
+                value = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"Line {number} is not valid JSON: {e}") from e
+            args = value.get("args") if isinstance(value, dict) else value
+            if not isinstance(args, list) or not args:
+                raise ValueError(f"Line {number} has no command arguments")
+            commands.append([str(arg) for arg in args])
+        else:
+            try:
+                commands.append(shlex.split(line))
+            except ValueError as e:
+                raise ValueError(f"Line {number} can not be parsed: {e}") from e
+
+    return commands
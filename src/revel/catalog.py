@@ -0,0 +1,120 @@
+"""Local catalogue of instance type and image metadata.
+
+Instance types and images rarely change, so their descriptions are kept in a
+JSON file next to the state files. Lookups only call the provider for entries
+that are missing or older than the TTL, in a single batched request, which
+lets create validate its configuration and list show hardware details
+without API round trips.
+"""
+
+import json
+import time
+from dataclasses import asdict
+from pathlib import Path
+from typing import Any, Callable, Optional, TypeVar
+
+from revel.providers.base import ImageInfo, InstanceTypeInfo, Provider
+
+CATALOG_FILE = ".catalog.json"
+CATALOG_TTL = 7 * 24 * 60 * 60
+
+# Machine fields resolved from the instance type of the machine
+INSTANCE_TYPE_FIELDS = [
+    "vcpus",
+    "memory",
+    "architectures",
+    "instance_storage",
+    "hibernation",
+]
+
+T = TypeVar("T", InstanceTypeInfo, ImageInfo)
+
+
+class Catalog:
+    def __init__(
+        self,
+        state_dir: Path,
+        provider: Provider,
+        ttl: float = CATALOG_TTL,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.path = state_dir / CATALOG_FILE
+        self.provider = provider
+        self.ttl = ttl
+        self.clock = clock
+        self._data: Optional[dict[str, dict[str, Any]]] = None
+
+    def _load(self) -> dict[str, dict[str, Any]]:
+        if self._data is None:
+            try:
+                self._data = json.loads(self.path.read_text())
+            except (OSError, ValueError):
+                self._data = {}
+        return self._data
+
+    def _save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self._load()))
+        tmp_path.replace(self.path)
+
+    def _lookup(
+        self,
+        kind: str,
+        keys: list[str],
+        fetch: Callable[[list[str]], list[T]],
+        key: Callable[[T], str],
+        parse: Callable[..., T],
+    ) -> dict[str, T]:
+        entries = self._load().setdefault(kind, {})
+        now = self.clock()
+        stale = [
+            k
+            for k in dict.fromkeys(keys)
+            if k not in entries or now - entries[k]["fetched_at"] > self.ttl
+        ]
+        if stale:
+            for info in fetch(stale):
+                entries[key(info)] = {"info": asdict(info), "fetched_at": now}
+            self._save()
+
+        return {k: parse(**entries[k]["info"]) for k in keys if k in entries}
+
+    def instance_types(self, names: list[str]) -> dict[str, InstanceTypeInfo]:
+        return self._lookup(
+            "instance_types",
+            names,
+            self.provider.describe_instance_types,
+            lambda info: info.name,
+            InstanceTypeInfo,
+        )
+
+    def images(self, ids: list[str]) -> dict[str, ImageInfo]:
+        return self._lookup(
+            "images",
+            ids,
+            self.provider.describe_images,
+            lambda info: info.id,
+            ImageInfo,
+        )
+
+    def validate(self, instance_type: str, image: str, hibernate: bool = False) -> None:
+        """Raise ValueError if image can not run on instance_type."""
+        type_info = self.instance_types([instance_type]).get(instance_type)
+        if not type_info:
+            raise ValueError(f"Unknown instance type {instance_type}")
+
+        image_info = self.images([image]).get(image)
+        if not image_info:
+            raise ValueError(f"Unknown image {image}")
+
+        if image_info.architecture not in type_info.architectures:
+            raise ValueError(
+                f"Image {image} is {image_info.architecture} but instance type "
+                f"{instance_type} supports {', '.join(type_info.architectures)}"
+            )
+
+        if hibernate and type_info.hibernation is False:
+            raise ValueError(
+                f"Instance type {instance_type} does not support hibernation"
+            )
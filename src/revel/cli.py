@@ -1,11 +1,15 @@
+import re
+import shlex
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
+from functools import lru_cache, partial, wraps
 from pathlib import Path
-from textwrap import dedent
-from typing import List, Optional
+from typing import TYPE_CHECKING, Any, Callable, List, Optional, cast
 
-import boto3
+import click
 import typer
-from botocore.exceptions import BotoCoreError
 from halo import Halo
 from sh import ErrorReturnCode  # TODO: This is a bit too leaky
 from tabulate import tabulate
@@ -13,20 +17,44 @@ from tabulate import tabulate
 from revel import Config
 from revel import __name__ as cli_name
 from revel import __version__ as cli_version
-from revel.config import RunCommand, SyncFiles
-from revel.machine import MachineManager
-from revel.providers.ssh import SSH
+from revel import batch as batch_file
+from revel import completion, metrics, scheduler, shards, steplog
+from revel.catalog import INSTANCE_TYPE_FIELDS, Catalog
+from revel.config import InitStep, RunCommand, SyncEntry, SyncFiles
+from revel.machine import (
+    CACHE_TAG,
+    Machine,
+    MachineManager,
+    MachineState,
+    state_owner,
+)
+from revel.providers.base import BATCH_SIZE, STOPPED, Provider, VolumeInfo, chunks
+from revel.providers.ssh import SSH, host_config, merge_config, wait_for_port
 from revel.state import state
 
+if TYPE_CHECKING:
+    from revel.providers.aws import AWS
+
 app = typer.Typer()
+cache_app = typer.Typer(help="Manage persistent cache volumes")
+app.add_typer(cache_app, name="cache")
+
+
+@lru_cache(maxsize=None)
+def get_aws(workers: int, rate: Optional[float]) -> "AWS":
+    # Imported lazily to keep the AWS stack out of shell completion
+    from revel.providers.aws import AWS
+
+    return AWS(max_pool_connections=max(10, workers), rate=rate)
 
 
-def get_ec2_resource():
-    # TODO: Replace with better an abstraction. This is an aweful hack to get this going.
-    # We might want to replace/abstract MachineManager
-    # and instantiate it only once here.
+def get_provider() -> Provider:
+    from botocore.exceptions import BotoCoreError
+
+    from revel.providers.ec2 import EC2Provider
+
     try:
-        return boto3.Session().resource("ec2")
+        return EC2Provider(get_aws(state["workers"], state["api_rate"]).ec2)
     except BotoCoreError as e:
         typer.secho(
             f"An error occurred while setting up the AWS session: {e}",
@@ -35,22 +63,192 @@ def get_ec2_resource():
         raise e
 
 
+@lru_cache(maxsize=None)
+def load_config(path: Path, mtime: float) -> Config:
+    return Config(path)
+
+
+def get_config(path: Path) -> Config:
+    """Parse the config once per process, unless it changes in between."""
+    try:
+        return load_config(path.resolve(), path.stat().st_mtime)
+    except ValueError as e:
+        typer.secho(f"Invalid config {path}: {e}", fg=typer.colors.RED)
+        raise typer.Exit(1)
+
+
+def api_calls() -> int:
+    # Only count calls of an existing session, do not set one up for it
+    if not get_aws.cache_info().currsize:
+        return 0
+    return get_aws(state["workers"], state["api_rate"]).limiter.calls
+
+
+def region() -> Optional[str]:
+    if not get_aws.cache_info().currsize:
+        return None
+    return get_aws(state["workers"], state["api_rate"]).session.region_name
+
+
+def tracked(operation: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Record the duration and outcome of a command in the metrics log."""
+
+    def decorator(command: Callable[..., Any]) -> Callable[..., Any]:
+        @wraps(command)
+        def wrapper(*args, **kwargs):
+            record = metrics.Record(
+                operation=operation,
+                machine="all" if kwargs.get("all") else str(kwargs.get("name", "")),
+                started=time.time(),
+            )
+            state["record"] = record
+            calls = api_calls()
+            start = time.monotonic()
+            try:
+                return command(*args, **kwargs)
+            except typer.Exit as e:
+                # A clean early exit means there was nothing to do
+                record.outcome = metrics.ERROR if e.exit_code else metrics.SKIPPED
+                raise e
+            except BaseException as e:
+                record.outcome = metrics.ERROR
+                raise e
+            finally:
+                record.duration = time.monotonic() - start
+                record.api_calls = api_calls() - calls
+                record.region = region()
+                state.pop("record", None)
+                metrics.append(state["state"], record)
+
+        return wrapper
+
+    return decorator
+
+
+def add_bytes_synced(size: int) -> None:
+    record = state.get("record")
+    if record:
+        record.bytes_synced += size
+
+
+def complete_machine(incomplete: str) -> list[str]:
+    return completion.complete(completion.machine_names(state["state"]), incomplete)
+
+
+def complete_instance(ctx: typer.Context, incomplete: str) -> list[str]:
+    config = ctx.find_root().params.get("config") or state["config"]
+    names = completion.instance_names(state["state"], Path(config))
+    return completion.complete(names, incomplete)
+
+
+def connect(
+    mm: MachineManager,
+    wake: bool,
+    known_hosts: Path,
+    multiplex: bool = False,
+    pin: bool = False,
+) -> SSH:
+    """Return a SSH client for the machine, waking it up if it is stopped.
+
+    pin stores the host key in known_hosts, required by connections that can
+    not prompt for it.
+    """
+    machine = mm.machine
+    if not machine.id:
+        typer.echo(f"Instance {machine.name} does not exist")
+        raise typer.Exit()
+
+    # The cached state might be stale, e.g. after an auto shutdown on the box,
+    # so always describe the instance once before deciding to wake it
+    machine = mm.refresh()
+
+    if wake and machine.state == MachineState.STOPPING:
+        # A stopping instance can not be started, let it stop first
+        with Halo(
+            text=f"Waiting for {machine.name} to stop...",
+            spinner="bouncingBar",
+            color="green",
+        ):
+            mm.provider.wait([cast(str, machine.id)], STOPPED)
+        machine = mm.refresh()
+
+    woken = False
+    if wake and machine.state in [MachineState.STOPPED, MachineState.SUSPENDED]:
+        with Halo(
+            text=f"Waking up {machine.name}...",
+            spinner="bouncingBar",
+            color="green",
+        ) as spinner:
+
+            def progress(text: str) -> None:
+                spinner.text = text
+
+            machine = mm.wake(progress=progress)
+            spinner.text = f"Waiting for SSH on {machine.public_ip_address}..."
+            wait_for_port(cast(str, machine.public_ip_address), machine.port)
+        woken = True
+
+    if not machine.public_ip_address:
+        typer.echo(f"Instance {machine.name} has no public IP")
+        raise typer.Exit()
+
+    # A woken up machine has a new IP, pin its host key instead of prompting
+    return SSH(
+        machine.user,
+        machine.public_ip_address,
+        known_hosts=known_hosts if woken or pin else None,
+        multiplex=multiplex or state["multiplex"],
+    )
+
+
+def created(managers: list[MachineManager]) -> list[MachineManager]:
+    """Leave out and report the machines without an instance."""
+    for mm in managers:
+        if not mm.machine.id:
+            typer.echo(f"Skipping {mm.machine.name}, it does not exist")
+    return MachineManager.created(managers)
+
+
+def for_each(
+    managers: list[MachineManager],
+    action: Callable[[list[MachineManager]], Any],
+    label: str,
+) -> None:
+    """Run a batch action over managers in chunks using the configured workers."""
+    managers = created(managers)
+    batches = chunks(managers, BATCH_SIZE)
+    with typer.progressbar(length=len(managers), label=label) as progress:
+        with ThreadPoolExecutor(max_workers=state["workers"]) as executor:
+            for batch, _ in zip(batches, executor.map(action, batches)):
+                progress.update(len(batch))
+
+    report = get_aws(state["workers"], state["api_rate"]).limiter.report()
+    if report:
+        typer.secho(report, fg=typer.colors.YELLOW)
+
+
 @app.command()
+@tracked("provision")
 def provision(
     ctx: typer.Context,
-    name: str = typer.Argument(default="default"),
+    name: str = typer.Argument(default="default", autocompletion=complete_machine),
     # NOTE: Using List instead of list because mypy is complaining
     extra: Optional[List[str]] = typer.Option(None),
+    jobs: int = typer.Option(1, min=1, help="Init steps to run at the same time"),
+    foreground: bool = typer.Option(
+        False, help="Attach steps to the terminal instead of logging their output"
+    ),
 ):
-    CONFIG = Config(ctx.obj["config"])
+    CONFIG = get_config(ctx.obj["config"])
     STATE_DIR = ctx.obj["state"]
+    KNOWN_HOSTS = ctx.obj["known_hosts"]
     DEBUG = ctx.obj["debug"]
-    SESSION = get_ec2_resource()
+    PROVIDER = get_provider()
 
     machine = MachineManager(
         STATE_DIR,
         name,
-        SESSION,
+        PROVIDER,
     ).machine
     if not machine:
         typer.echo(f"Instance {name} does not exist")
@@ -65,43 +263,114 @@ def provision(
         typer.echo("Failed to find instance config")
         raise typer.Exit()
 
-    client = SSH(user=machine.user, host=machine.public_ip_address)
-    for init in instance_config.init:
-        if type(init) is SyncFiles:
-            for src, dst in init:
-                typer.echo(f"Uploading file {src} to {dst}")
-                command = client.sync(src=src, dst=dst)
+    if foreground and jobs > 1:
+        typer.echo("Only one step at a time can run in the foreground")
+        raise typer.Abort()
+
+    # Captured steps cannot prompt for the host key, so it is pinned
+    # beforehand. Concurrent steps share one multiplexed connection.
+    client = SSH(
+        user=machine.user,
+        host=machine.public_ip_address,
+        known_hosts=None if foreground else KNOWN_HOSTS,
+        multiplex=jobs > 1 or ctx.obj["multiplex"],
+    )
+    run_log = steplog.RunLog(STATE_DIR, name)
+
+    def execute(step: InitStep) -> None:
+        with run_log.step(step.id) as log:
+            echo: Callable[[str], None]
+            if foreground:
+                echo = partial(typer.echo, nl=False)
+                output: dict[str, Any] = {}
+            else:
+                echo = log.write
+                output = {"_out": log.write, "_err": log.write}
+
+            if type(step.action) is SyncFiles:
+                for src, dst in step.action:
+                    echo(f"Uploading file {src} to {dst}\n")
+                    command = client.sync(src=src, dst=dst, foreground=foreground)
+                    if DEBUG:
+                        echo(f"{command}\n")
+                    command(**output)
+
+            elif type(step.action) is RunCommand:
+                echo(f"Executing {step.action}\n")
+                command = client.run(
+                    opts=extra,
+                    args=[step.action],
+                    foreground=foreground,
+                )
                 if DEBUG:
-                    typer.echo(command)
-                try:
-                    command()
-                except ErrorReturnCode:
-                    raise typer.Abort()
-
-        elif type(init) is RunCommand:
-            typer.echo(f"Executing {init}")
-            command = client.run(
-                opts=extra,
-                args=[init],
-            )
-            if DEBUG:
-                typer.echo(command)
-            try:
-                command()
-            except ErrorReturnCode:
-                raise typer.Abort()
+                    echo(f"{command}\n")
+                command(**output)
+            else:
+                echo(f"Unkown type {type(step.action)} for {step.action}\n")
+
+    try:
+        if foreground:
+            scheduler.run(instance_config.init, execute, jobs=jobs)
         else:
-            typer.echo(f"Unkown type {type(init)} for {init}")
+            with steplog.StatusBoard(run_log):
+                scheduler.run(instance_config.init, execute, jobs=jobs)
+    except ErrorReturnCode:
+        for log in run_log.failed():
+            step = log.path.stem
+            typer.secho(
+                f"Step {step} failed with exit code {log.exit_code}, last lines:",
+                fg=typer.colors.RED,
+            )
+            typer.echo("\n".join(steplog.tail(log.path)))
+            typer.echo(f"Full output: {cli_name} logs {name} {step}")
+        raise typer.Abort()
+
+
+@app.command()
+def logs(
+    ctx: typer.Context,
+    name: str = typer.Argument(default="default", autocompletion=complete_machine),
+    step: Optional[str] = typer.Argument(None, help="Step to show the output of"),
+    tail: Optional[int] = typer.Option(None, help="Only show the last lines"),
+):
+    """Show the steps of the last provision run or the output of one."""
+    STATE_DIR = ctx.obj["state"]
+    run = steplog.read_run(STATE_DIR, name)
+    if not run:
+        typer.echo(f"Instance {name} has not been provisioned")
+        raise typer.Exit()
+
+    if step is None:
+        table = tabulate(
+            [
+                [id, info["status"], info["exit_code"], f"{info['duration']}s"]
+                for id, info in run.items()
+            ],
+            headers=["Step", "Status", "Exit code", "Duration"],
+        )
+        typer.echo(table)
+        return
+
+    if step not in run:
+        typer.echo(f"Step {step} did not run, steps: {', '.join(run)}")
+        raise typer.Exit(1)
+
+    path = steplog.step_path(STATE_DIR, name, step)
+    if tail:
+        typer.echo("\n".join(steplog.tail(path, tail)))
+    else:
+        typer.echo(steplog.read(path), nl=False)
 
 
 @app.command()
+@tracked("create")
 def create(
     ctx: typer.Context,
-    name: str = typer.Argument(default="default"),
+    name: str = typer.Argument(default="default", autocompletion=complete_instance),
 ):
-    CONFIG = Config(ctx.obj["config"])
+    CONFIG = get_config(ctx.obj["config"])
     STATE_DIR = ctx.obj["state"]
-    SESSION = get_ec2_resource()
+    PROVIDER = get_provider()
     instances = CONFIG.instances
     if not instances:
         typer.echo("Unable to find instances in the configuration")
@@ -112,10 +381,20 @@ def create(
         typer.echo(f"Unable to find instance {name}")
         raise typer.Abort()
 
+    try:
+        Catalog(STATE_DIR, PROVIDER).validate(
+            instance_config.size,
+            instance_config.ami,
+            hibernate=instance_config.hibernate,
+        )
+    except ValueError as e:
+        typer.secho(f"Invalid instance {name}: {e}", fg=typer.colors.RED)
+        raise typer.Abort()
+
     mm = MachineManager(
         STATE_DIR,
         name,
-        SESSION,
+        PROVIDER,
     )
     machine = mm.machine
 
@@ -135,6 +414,11 @@ def create(
                 ami=instance_config.ami,
                 instance_type=instance_config.size,
                 key_name="gonzalopeci",
+                disk=instance_config.disk,
+                volumes=instance_config.volumes,
+                scratch=instance_config.scratch,
+                cache=instance_config.cache,
+                hibernate=instance_config.hibernate,
             )
 
         typer.echo(f"Instance id: {machine.id}")
@@ -143,18 +427,19 @@ def create(
 
 
 @app.command()
+@tracked("destroy")
 def destroy(
     ctx: typer.Context,
-    name: str = typer.Argument(default="default"),
+    name: str = typer.Argument(default="default", autocompletion=complete_machine),
     all: bool = typer.Option(False, "--all"),
 ):
     STATE_DIR = ctx.obj["state"]
-    SESSION = get_ec2_resource()
+    PROVIDER = get_provider()
     if all:
         typer.confirm(
             "😱 About to destroy all machines, Do you want to continue?", abort=True
         )
-        managers = MachineManager.list(STATE_DIR, SESSION)
+        managers = MachineManager.list(STATE_DIR, PROVIDER)
     else:
         typer.confirm(
             f"💣 About to destroy {name}, do you want to continue?", abort=True
@@ -163,7 +448,7 @@ def destroy(
             MachineManager(
                 STATE_DIR,
                 name,
-                SESSION,
+                PROVIDER,
             )
         ]
 
@@ -197,8 +482,8 @@ def list_machines(
     ),
 ):
     STATE_DIR = ctx.obj["state"]
-    SESSION = get_ec2_resource()
-    machines = [mm.machine for mm in MachineManager.list(STATE_DIR, SESSION)]
+    PROVIDER = get_provider()
+    machines = [mm.machine for mm in MachineManager.list(STATE_DIR, PROVIDER)]
 
     aliases = [
         field.split(":")[1] if field.split(":")[1:] else field.split(":")[0]
@@ -206,10 +491,21 @@ def list_machines(
     ]
     fields = [field.split(":")[0] for field in fields]
 
+    # Hardware details come from the catalogue, only queried when listed
+    instance_types = {}
+    if any(field.lower() in INSTANCE_TYPE_FIELDS for field in fields):
+        instance_types = Catalog(STATE_DIR, PROVIDER).instance_types(
+            [machine.instance_type for machine in machines if machine.instance_type]
+        )
+
+    def value(machine: Machine, field: str) -> Any:
+        if field in INSTANCE_TYPE_FIELDS:
+            info = instance_types.get(machine.instance_type or "")
+            return getattr(info, field) if info else None
+        return getattr(machine, field)
+
     headers = [alias.title().replace("_", " ") for alias in aliases]
-    body = [
-        [getattr(machine, field.lower()) for field in fields] for machine in machines
-    ]
+    body = [[value(machine, field.lower()) for field in fields] for machine in machines]
 
     table = tabulate(
         body,
@@ -221,51 +517,45 @@ def list_machines(
 
 
 @app.command()
+@tracked("refresh")
 def refresh(
     ctx: typer.Context,
-    name: str = typer.Argument(default="default"),
+    name: str = typer.Argument(default="default", autocompletion=complete_machine),
     all: bool = typer.Option(False, "--all"),
 ):
     STATE_DIR = ctx.obj["state"]
-    SESSION = get_ec2_resource()
+    PROVIDER = get_provider()
     if all:
-        managers = MachineManager.list(STATE_DIR, SESSION)
+        managers = MachineManager.list(STATE_DIR, PROVIDER)
     else:
         managers = [
             MachineManager(
                 STATE_DIR,
                 name,
-                SESSION,
+                PROVIDER,
             )
         ]
 
-    with typer.progressbar(managers, label="Refreshing") as progress:
-        for manager in progress:
-            manager.refresh()
+    for_each(managers, MachineManager.refresh_many, label="Refreshing")
 
 
 @app.command()
 def ssh(
     ctx: typer.Context,
-    name: str = typer.Argument(default="default"),
+    name: str = typer.Argument(default="default", autocompletion=complete_machine),
     print: bool = typer.Option(False),
+    wake: bool = typer.Option(True, help="Start the machine if it is stopped"),
 ):
     STATE_DIR = ctx.obj["state"]
-    SESSION = get_ec2_resource()
-    machine = MachineManager(
+    KNOWN_HOSTS = ctx.obj["known_hosts"]
+    PROVIDER = get_provider()
+    mm = MachineManager(
         STATE_DIR,
         name,
-        SESSION,
-    ).machine
-    if not machine:
-        typer.echo(f"Instance {name} does not exist")
-        raise typer.Exit()
-
-    if not machine.public_ip_address:
-        typer.echo(f"Instance {name} has no public IP")
-        raise typer.Exit()
+        PROVIDER,
+    )
 
-    client = SSH(machine.user, machine.public_ip_address)
+    client = connect(mm, wake=wake, known_hosts=KNOWN_HOSTS)
     command = client.run(args=[])
     if print:
         typer.echo(command)
@@ -273,118 +563,534 @@ def ssh(
         command()
 
 
+@app.command(name="exec")
+def exec_command(
+    ctx: typer.Context,
+    name: str = typer.Argument(..., autocompletion=complete_machine),
+    # NOTE: Using List instead of list because mypy is complaining
+    command: List[str] = typer.Argument(...),
+    wake: bool = typer.Option(True, help="Start the machine if it is stopped"),
+):
+    STATE_DIR = ctx.obj["state"]
+    KNOWN_HOSTS = ctx.obj["known_hosts"]
+    DEBUG = ctx.obj["debug"]
+    PROVIDER = get_provider()
+    mm = MachineManager(STATE_DIR, name, PROVIDER)
+
+    client = connect(mm, wake=wake, known_hosts=KNOWN_HOSTS)
+    remote_command = client.run(args=[shlex.join(command)])
+    if DEBUG:
+        typer.echo(remote_command)
+    try:
+        remote_command()
+    except ErrorReturnCode as e:
+        raise typer.Exit(e.exit_code)
+
+
 @app.command()
+@tracked("start")
 def start(
     ctx: typer.Context,
-    name: str = typer.Argument(default="default"),
+    name: str = typer.Argument(default="default", autocompletion=complete_machine),
     all: bool = typer.Option(False, "--all"),
 ):
     STATE_DIR = ctx.obj["state"]
-    SESSION = get_ec2_resource()
+    PROVIDER = get_provider()
     if all:
-        managers = MachineManager.list(STATE_DIR, SESSION)
+        managers = MachineManager.list(STATE_DIR, PROVIDER)
     else:
-        managers = [MachineManager(STATE_DIR, name, SESSION)]
+        managers = [MachineManager(STATE_DIR, name, PROVIDER)]
 
-    with typer.progressbar(managers, label="Starting") as progress:
-        for manager in progress:
-            manager.start()
+    for_each(managers, MachineManager.start_many, label="Starting")
 
 
 @app.command()
+@tracked("stop")
 def stop(
     ctx: typer.Context,
-    name: str = typer.Argument(default="default"),
+    name: str = typer.Argument(default="default", autocompletion=complete_machine),
     all: bool = typer.Option(False, "--all"),
 ):
     STATE_DIR = ctx.obj["state"]
-    SESSION = get_ec2_resource()
+    PROVIDER = get_provider()
     if all:
-        managers = MachineManager.list(STATE_DIR, SESSION)
+        managers = MachineManager.list(STATE_DIR, PROVIDER)
     else:
-        managers = [MachineManager(STATE_DIR, name, SESSION)]
+        managers = [MachineManager(STATE_DIR, name, PROVIDER)]
 
-    with typer.progressbar(managers, label="Stopping") as progress:
-        for manager in progress:
-            manager.stop()
+    for_each(managers, MachineManager.stop_many, label="Stopping")
 
 
 @app.command()
+@tracked("suspend")
+def suspend(
+    ctx: typer.Context,
+    name: str = typer.Argument(default="default", autocompletion=complete_machine),
+    all: bool = typer.Option(False, "--all"),
+):
+    STATE_DIR = ctx.obj["state"]
+    PROVIDER = get_provider()
+    if all:
+        managers = MachineManager.list(STATE_DIR, PROVIDER)
+    else:
+        managers = [MachineManager(STATE_DIR, name, PROVIDER)]
+
+    hibernating = []
+    for mm in managers:
+        if mm.machine.hibernate:
+            hibernating.append(mm)
+        else:
+            typer.echo(f"Skipping {mm.machine.name}, it was not launched to hibernate")
+    for_each(hibernating, MachineManager.suspend_many, label="Suspending")
+
+
+@app.command()
+@tracked("sync")
 def sync(
     ctx: typer.Context,
-    name: str = typer.Argument(default="default"),
+    name: str = typer.Argument(default="default", autocompletion=complete_machine),
+    wake: bool = typer.Option(True, help="Start the machine if it is stopped"),
 ):
-    CONFIG = Config(ctx.obj["config"])
+    CONFIG = get_config(ctx.obj["config"])
     STATE_DIR = ctx.obj["state"]
+    KNOWN_HOSTS = ctx.obj["known_hosts"]
     DEBUG = ctx.obj["debug"]
-    SESSION = get_ec2_resource()
-    machine = MachineManager(
+    PROVIDER = get_provider()
+    mm = MachineManager(
         STATE_DIR,
         name,
-        SESSION,
-    ).machine
-    if not machine:
-        typer.echo(f"Instance {name} does not exist")
-        raise typer.Exit()
-
-    if not machine.public_ip_address:
-        typer.echo(f"Instance {name} has no public IP")
-        raise typer.Exit()
+        PROVIDER,
+    )
 
     instance_config = CONFIG.instances.get(name)
     if not instance_config:
         typer.echo("Failed to find instance config")
         raise typer.Exit()
 
-    client = SSH(machine.user, machine.public_ip_address)
-    for src, dst in instance_config.sync:
-        typer.echo(f"Uploading file {src} to {dst}")
-        command = client.sync(src=src, dst=dst)
+    client = connect(
+        mm,
+        wake=wake,
+        known_hosts=KNOWN_HOSTS,
+        multiplex=any(entry.shards > 1 for entry in instance_config.sync),
+    )
+    for entry in instance_config.sync:
+        opts = []
+        if entry.compress:
+            opts = ["--compress", f"--compress-level={entry.compress}"]
+
+        src = Path(entry.src).expanduser()
+        if entry.shards > 1 and src.is_dir():
+            files = shards.split(shards.scan(src), entry.shards)
+            with typer.progressbar(
+                length=sum(shard.size for shard in files),
+                label=f"Uploading {entry.src} to {entry.dst} in {len(files)} shards",
+            ) as progress:
+                status = shards.upload(
+                    client, entry.src, entry.dst, files, opts, progress.update
+                )
+            add_bytes_synced(sum(shard.size for shard in files))
+            if status:
+                raise typer.Exit(status)
+            continue
+
+        typer.echo(f"Uploading file {entry.src} to {entry.dst}")
+        # Directories are copied whole, into the same place as when sharded
+        command = client.sync(src=entry.src, dst=entry.dst, opts=["--archive", *opts])
         if DEBUG:
             typer.echo(command)
         try:
             command()
         except ErrorReturnCode:
             raise typer.Abort()
+        add_bytes_synced(shards.total_size(src))
+
+
+def running_clients(
+    state_dir: Path, provider: Provider, known_hosts: Path
+) -> dict[str, SSH]:
+    """Return multiplexed SSH clients for every running machine by name."""
+    managers = created(MachineManager.list(state_dir, provider))
+    MachineManager.refresh_many(managers)
+
+    clients = {}
+    for mm in managers:
+        machine = mm.machine
+        if machine.state != MachineState.RUNNING or not machine.public_ip_address:
+            typer.echo(f"Skipping {machine.name}, it is {machine.state.value.lower()}")
+            continue
+        clients[machine.name] = SSH(
+            machine.user,
+            machine.public_ip_address,
+            known_hosts=known_hosts,
+            multiplex=True,
+        )
+    return clients
+
+
+@app.command()
+@tracked("pull")
+def pull(
+    ctx: typer.Context,
+    name: str = typer.Argument(default="default", autocompletion=complete_machine),
+    all: bool = typer.Option(
+        False, "--all", help="Pull from every running machine into dst/<machine>"
+    ),
+    wake: bool = typer.Option(True, help="Start the machine if it is stopped"),
+):
+    """Fetch the pull entries of the instance config from machines."""
+    CONFIG = get_config(ctx.obj["config"])
+    STATE_DIR = ctx.obj["state"]
+    KNOWN_HOSTS = ctx.obj["known_hosts"]
+    DEBUG = ctx.obj["debug"]
+    WORKERS = ctx.obj["workers"]
+    PROVIDER = get_provider()
+
+    instance_config = CONFIG.instances.get(name)
+    if not instance_config:
+        typer.echo("Failed to find instance config")
+        raise typer.Exit()
+    if not instance_config.pull:
+        typer.echo(f"Instance {name} has no pull entries")
+        raise typer.Exit()
+
+    if all:
+        clients = running_clients(STATE_DIR, PROVIDER, KNOWN_HOSTS)
+    else:
+        mm = MachineManager(STATE_DIR, name, PROVIDER)
+        clients = {
+            name: connect(
+                mm, wake=wake, known_hosts=KNOWN_HOSTS, multiplex=True, pin=True
+            )
+        }
+
+    def open_connection(item: tuple[str, SSH]) -> int:
+        machine_name, client = item
+        try:
+            client.run(args=["true"], foreground=False)()
+        except ErrorReturnCode as e:
+            typer.secho(
+                f"Failed to connect to {machine_name}: {e.stderr.decode().strip()}",
+                fg=typer.colors.RED,
+            )
+            return e.exit_code
+        return 0
+
+    def fetch(item: tuple[str, SSH, SyncEntry]) -> int:
+        machine_name, client, entry = item
+        dst = Path(entry.dst).expanduser()
+        if all:
+            dst = dst / machine_name
+        dst.mkdir(parents=True, exist_ok=True)
+
+        opts = ["--archive", "--compress", "--stats"]
+        if entry.compress is not None:
+            opts.append(f"--compress-level={entry.compress}")
+        command = client.pull(src=entry.src, dst=str(dst), opts=opts, foreground=False)
+        if DEBUG:
+            typer.echo(command)
+        try:
+            result = command()
+        except ErrorReturnCode as e:
+            typer.secho(
+                f"Failed to pull {machine_name}:{entry.src}: "
+                f"{e.stderr.decode().strip()}",
+                fg=typer.colors.RED,
+            )
+            return e.exit_code
+
+        typer.echo(f"Pulled {machine_name}:{entry.src} to {dst}")
+        size = re.search(r"Total file size: ([\d,]+)", str(result))
+        if size:
+            pulled.append(int(size.group(1).replace(",", "")))
+        return 0
+
+    # Connections are opened first so the entries of a machine share them
+    pulled: list[int] = []
+    workers = max(WORKERS, len(instance_config.pull))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        connected = dict(zip(clients, executor.map(open_connection, clients.items())))
+        statuses = [status for status in connected.values() if status]
+        items = [
+            (machine_name, client, entry)
+            for machine_name, client in clients.items()
+            if not connected[machine_name]
+            for entry in instance_config.pull
+        ]
+        statuses += [status for status in executor.map(fetch, items) if status]
+
+    add_bytes_synced(sum(pulled))
+    if statuses:
+        raise typer.Exit(statuses[0])
 
 
 @app.command()
 def ssh_config(
     ctx: typer.Context,
-    file: typer.FileTextWrite = typer.Option(
+    file: Path = typer.Option(
         f"{Path.home()}/.ssh/revel.config",
         show_default=False,
         show_envvar=False,
         help="[default: ~/.ssh/revel.config]",
     ),
-    name: str = typer.Argument(default="default"),
+    name: str = typer.Argument(default="default", autocompletion=complete_machine),
+    all: bool = typer.Option(False, "--all"),
+    multiplex: bool = typer.Option(
+        False, help="Reuse connections with ControlMaster/ControlPersist"
+    ),
+    compression: bool = typer.Option(False),
+    known_hosts: bool = typer.Option(
+        False, help="Pin host keys in the revel known_hosts file"
+    ),
     print: bool = typer.Option(False),
 ):
     STATE_DIR = ctx.obj["state"]
-    SESSION = get_ec2_resource()
-    machine = MachineManager(STATE_DIR, name, SESSION).machine
-    if not machine:
-        typer.echo(f"Instance {name} does not exist")
-        raise typer.Exit()
+    KNOWN_HOSTS = ctx.obj["known_hosts"]
+    PROVIDER = get_provider()
+    if all:
+        machines = [mm.machine for mm in MachineManager.list(STATE_DIR, PROVIDER)]
+    else:
+        machines = [MachineManager(STATE_DIR, name, PROVIDER).machine]
 
-    if not machine.public_ip_address:
-        typer.echo(f"Instance {name} has no public IP")
-        raise typer.Exit()
+    stanzas = {}
+    for machine in machines:
+        if not machine:
+            typer.echo(f"Instance {name} does not exist")
+            raise typer.Exit()
+
+        if not machine.public_ip_address:
+            typer.echo(f"Instance {machine.name} has no public IP")
+            if all:
+                continue
+            raise typer.Exit()
+
+        if known_hosts:
+            SSH(machine.user, machine.public_ip_address, known_hosts=KNOWN_HOSTS)
+
+        alias = f"{machine.name}.revel"
+        stanzas[alias] = host_config(
+            alias,
+            user=machine.user,
+            hostname=machine.public_ip_address,
+            port=machine.port,
+            multiplex=multiplex,
+            compression=compression,
+            known_hosts=KNOWN_HOSTS if known_hosts else None,
+        )
+
+    if print:
+        typer.echo("\n".join(stanzas.values()))
+        return
 
-    # host = f"{machine.user}@{machine.host}"
+    current = file.read_text() if file.exists() else ""
+    config = merge_config(current, stanzas, prune_suffix=".revel" if all else None)
+    if config == current:
+        typer.echo(f"{file} is up to date")
+        return
 
-    config = dedent(
-        f"""\
-    Host {name}.revel
-        User {machine.user}
-        Hostname {machine.public_ip_address}
+    file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = file.with_suffix(".tmp")
+    tmp_file.write_text(config)
+    tmp_file.replace(file)
+    typer.echo(f"Updated {file} with {len(stanzas)} host(s)")
+
+
+class MetricsGroup(str, Enum):
+    operation = "operation"
+    machine = "machine"
+    region = "region"
+    outcome = "outcome"
+
+
+@app.command(name="metrics")
+def show_metrics(
+    ctx: typer.Context,
+    by: MetricsGroup = typer.Option(MetricsGroup.operation, help="Group records by"),
+    since: Optional[float] = typer.Option(
+        None, help="Only include operations of the last hours"
+    ),
+    textfile: Optional[Path] = typer.Option(
+        None, help="Write a Prometheus textfile collector file"
+    ),
+    refresh: bool = typer.Option(False, help="Refresh machine states to count them"),
+    format: ListFormat = ListFormat.simple,
+):
+    """Show operation latency percentiles from the metrics log."""
+    STATE_DIR = ctx.obj["state"]
+    records = metrics.read(
+        STATE_DIR, since=time.time() - since * 3600 if since is not None else None
+    )
+
+    table = tabulate(
+        metrics.summarize(records, by=by.value),
+        headers=[
+            by.value.title(),
+            "Count",
+            "Errors",
+            "P50 (s)",
+            "P95 (s)",
+            "P99 (s)",
+            "Max (s)",
+            "API calls",
+            "Bytes synced",
+        ],
+        tablefmt=format,
+    )
+    typer.echo(table)
+
+    if textfile:
+        PROVIDER = get_provider()
+        managers = MachineManager.list(STATE_DIR, PROVIDER)
+        if refresh:
+            MachineManager.refresh_many(managers)
+        states = Counter(mm.machine.state.value for mm in managers)
+        metrics.write_textfile(textfile, metrics.prometheus(records, states))
+        typer.echo(f"Wrote {textfile}")
+
+
+def global_options(obj: dict[str, Any]) -> list[str]:
+    """Return the global options reproducing the current invocation."""
+    options = ["--config", str(obj["config"]), "--workers", str(obj["workers"])]
+    if obj["debug"]:
+        options.append("--debug")
+    if obj["api_rate"] is not None:
+        options += ["--api-rate", str(obj["api_rate"])]
+    return options
+
+
+@app.command()
+def batch(
+    ctx: typer.Context,
+    file: typer.FileText = typer.Argument(..., help="Commands file, - for stdin"),
+    keep_going: bool = typer.Option(False, help="Run the remaining commands on error"),
+):
+    """Run revel commands from a file in a single process.
+
+    Commands share the AWS session, the parsed config and multiplexed SSH
+    connections.
     """
+    if ctx.obj["batch"]:
+        # Checked here rather than on the line, options can come before it
+        typer.secho("Batches can not be nested", fg=typer.colors.RED)
+        raise typer.Exit(1)
+
+    try:
+        commands = batch_file.parse(file.read())
+    except ValueError as e:
+        typer.secho(str(e), fg=typer.colors.RED)
+        raise typer.Exit(1)
+
+    command = typer.main.get_command(app)
+    options = global_options(ctx.obj)
+    multiplex = ctx.obj["multiplex"]
+    ctx.obj["multiplex"] = True
+    ctx.obj["batch"] = True
+    results: list[tuple[str, int, str]] = []
+    try:
+        for args in commands:
+            line = shlex.join(args)
+            typer.secho(f"$ {cli_name} {line}", bold=True)
+            start = time.monotonic()
+            try:
+                result = command.main(
+                    args=options + args,
+                    prog_name=cli_name,
+                    standalone_mode=False,
+                )
+                code = result if isinstance(result, int) else 0
+            except click.ClickException as e:
+                e.show()
+                code = e.exit_code
+            except click.Abort:
+                code = 1
+            except Exception as e:
+                if ctx.obj["debug"]:
+                    raise e
+                typer.secho(f"{type(e).__name__}: {e}", fg=typer.colors.RED)
+                code = 1
+
+            results.append((line, code, f"{time.monotonic() - start:.1f}s"))
+            if code and not keep_going:
+                break
+    finally:
+        ctx.obj["multiplex"] = multiplex
+        ctx.obj["batch"] = False
+
+    typer.echo(tabulate(results, headers=["Command", "Exit code", "Duration"]))
+    skipped = len(commands) - len(results)
+    if skipped:
+        typer.secho(f"Skipped {skipped} commands", fg=typer.colors.YELLOW)
+
+    failed = [code for _, code, _ in results if code]
+    if failed:
+        raise typer.Exit(failed[0])
+
+
+def _cache_owner(volume: VolumeInfo) -> Optional[str]:
+    # Tags hold <state dir owner>/<machine name>
+    return volume.tags.get(CACHE_TAG, "").split("/", 1)[-1]
+
+
+@cache_app.command(name="list")
+def list_cache(
+    ctx: typer.Context,
+    format: ListFormat = ListFormat.simple,
+):
+    STATE_DIR = ctx.obj["state"]
+    PROVIDER = get_provider()
+    body = [
+        [
+            _cache_owner(volume),
+            volume.id,
+            volume.size,
+            volume.type,
+            volume.zone,
+            volume.state,
+            ",".join(volume.attachments),
+        ]
+        for volume in MachineManager.list_cache_volumes(
+            PROVIDER, owner=state_owner(STATE_DIR)
+        )
+    ]
+    table = tabulate(
+        body,
+        headers=["Machine", "Id", "Size", "Type", "Zone", "State", "Instance"],
+        tablefmt=format,
     )
 
-    if print:
-        typer.echo(config)
-    else:
-        file.write(config)
+    typer.echo(table)
+
+
+@cache_app.command(name="prune")
+def prune_cache(
+    ctx: typer.Context,
+    name: Optional[str] = typer.Argument(None, autocompletion=complete_machine),
+):
+    """Delete detached cache volumes no longer tracked by any machine."""
+    STATE_DIR = ctx.obj["state"]
+    PROVIDER = get_provider()
+    tracked = {
+        mm.machine.cache_volume_id for mm in MachineManager.list(STATE_DIR, PROVIDER)
+    }
+    volumes = [
+        volume
+        for volume in MachineManager.list_cache_volumes(
+            PROVIDER, owner=state_owner(STATE_DIR)
+        )
+        if volume.state == "available"
+        and volume.id not in tracked
+        and (name is None or _cache_owner(volume) == name)
+    ]
+    if not volumes:
+        typer.echo("No cache volumes to prune")
+        raise typer.Exit()
+
+    typer.confirm(
+        f"🧹 About to delete {len(volumes)} cache volume(s), do you want to continue?",
+        abort=True,
+    )
+    for volume in volumes:
+        PROVIDER.delete_volume(volume.id)
+        typer.echo(f"Cache volume {volume.id} of {_cache_owner(volume)} deleted")
 
 
 def version_callback(value: bool):
@@ -401,7 +1107,17 @@ def main(
     ),
     debug: bool = typer.Option(state["debug"]),
     config: Path = typer.Option(state["config"]),
+    workers: int = typer.Option(
+        state["workers"], min=1, help="Concurrent workers for fleet operations"
+    ),
+    api_rate: Optional[float] = typer.Option(
+        state["api_rate"],
+        min=0.01,
+        help="Max AWS API requests per second per action",
+    ),
 ):
     ctx.obj = state
     ctx.obj["config"] = config
     ctx.obj["debug"] = debug
+    ctx.obj["workers"] = workers
+    ctx.obj["api_rate"] = api_rate
@@ -0,0 +1,62 @@
+"""Names offered by shell completion.
+
+Completion runs on every TAB press, so it never imports the AWS stack or loads
+machine states. Machine names are the names of the state files, a single
+directory read that concurrent commands can not get out of date. Instance
+names are kept in a small JSON index next to the state files and re-read from
+the config only when its modification time changes.
+"""
+
+import json
+import os
+from pathlib import Path
+from typing import Any
+
+import yaml
+
+INDEX_FILE = ".index.json"
+
+
+def _index_path(state_dir: Path) -> Path:
+    return state_dir / INDEX_FILE
+
+
+def _load(state_dir: Path) -> dict[str, Any]:
+    try:
+        return json.loads(_index_path(state_dir).read_text())
+    except (OSError, ValueError):
+        # Missing or corrupt, it is rebuilt from the config on the next save
+        return {"config": None, "config_mtime": None, "instances": []}
+
+
+def _save(state_dir: Path, index: dict[str, Any]) -> None:
+    state_dir.mkdir(parents=True, exist_ok=True)
+    path = _index_path(state_dir)
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(index))
+    tmp_path.replace(path)
+
+
+def machine_names(state_dir: Path) -> list[str]:
+    return sorted(f.stem for f in state_dir.glob("*.yml"))
+
+
+def instance_names(state_dir: Path, config: Path) -> list[str]:
+    index = _load(state_dir)
+    try:
+        mtime = config.stat().st_mtime
+    except OSError:
+        return []
+
+    path = str(config.resolve())
+    if index["config"] != path or index["config_mtime"] != mtime:
+        with config.open("r") as config_file:
+            instances = yaml.safe_load(config_file) or {}
+        index.update(config=path, config_mtime=mtime, instances=sorted(instances))
+        _save(state_dir, index)
+
+    return list(index["instances"])
+
+
+def complete(names: list[str], incomplete: str) -> list[str]:
+    return [name for name in names if name.startswith(incomplete)]
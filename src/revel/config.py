@@ -1,21 +1,42 @@
+import re
 from collections import UserList
 from dataclasses import dataclass, field
 from enum import Enum
 from pathlib import Path
-from typing import Optional, Union
+from typing import Any, Optional, Union
 
 import yaml
 
+# Step ids name their log files, so they must be plain file names
+STEP_ID = re.compile(r"[A-Za-z0-9][A-Za-z0-9_.-]*")
+
 
 class DiskType(Enum):
     GP2 = "GP2"
+    GP3 = "GP3"
     IO1 = "IO1"
+    IO2 = "IO2"
 
 
 @dataclass
 class Disk:
     type: DiskType
     size: int
+    iops: Optional[int] = None
+    throughput: Optional[int] = None
+    device: Optional[str] = None
+    mount: Optional[str] = None
+
+    @staticmethod
+    def parse(**kwargs) -> "Disk":
+        return Disk(
+            type=DiskType(str(kwargs.get("type", DiskType.GP3.value)).upper()),
+            size=kwargs.get("size", 10),
+            iops=kwargs.get("iops", None),
+            throughput=kwargs.get("throughput", None),
+            device=kwargs.get("device", None),
+            mount=kwargs.get("mount", None),
+        )
 
 
 SyncFile = tuple[str, str]
@@ -25,11 +46,119 @@ class SyncFiles(UserList[SyncFile]):
     pass
 
 
+@dataclass
+class SyncEntry:
+    src: str
+    dst: str
+    # Large trees can be split in shards uploaded by parallel rsync streams
+    shards: int = 1
+    compress: Optional[int] = None
+
+    @staticmethod
+    def parse(entry: Union[str, dict[str, Any]]) -> "SyncEntry":
+        if isinstance(entry, str):
+            src, dst = entry.split(":")[0], entry.split(":")[1]
+            return SyncEntry(src=src, dst=dst)
+
+        return SyncEntry(
+            src=entry["src"],
+            dst=entry["dst"],
+            shards=int(entry.get("shards", 1)),
+            compress=entry.get("compress", None),
+        )
+
+
 RunCommand = str
 
 Init = Union[SyncFiles, RunCommand]
 
 
+@dataclass
+class InitStep:
+    id: str
+    action: Init
+    needs: list[str] = field(default_factory=list[str])
+
+    @staticmethod
+    def parse_action(**kwargs) -> Optional[Init]:
+        if kwargs.get("files", None):
+            # Create touple of files to sync
+            return SyncFiles(
+                [
+                    (file.split(":")[0], file.split(":")[1])
+                    for file in kwargs.get("files", [])
+                ]
+            )
+        elif kwargs.get("run", None):
+            return kwargs.get("run")
+
+        return None
+
+    @staticmethod
+    def parse_needs(needs: Union[str, list[str]]) -> list[str]:
+        # A single need can be given as a plain string
+        return [needs] if isinstance(needs, str) else [str(need) for need in needs]
+
+    @staticmethod
+    def parse_steps(init: list[dict[str, Any]]) -> list["InitStep"]:
+        """Parse init steps into a dependency graph.
+
+        Steps without needs depend on the previous entry, so a flat list runs
+        as a sequential chain. Steps of a parallel group share the needs of
+        the group and the next entry depends on all of them.
+        """
+        steps: list[InitStep] = []
+        previous: list[str] = []
+        for index, entry in enumerate(init, start=1):
+            if entry.get("parallel", None):
+                needs = InitStep.parse_needs(entry.get("needs", previous))
+                group = []
+                for child_index, child in enumerate(entry["parallel"], start=1):
+                    action = InitStep.parse_action(**child)
+                    if action is None:
+                        continue
+                    step = InitStep(
+                        id=str(child.get("id", f"step-{index}.{child_index}")),
+                        action=action,
+                        needs=InitStep.parse_needs(child.get("needs", needs)),
+                    )
+                    steps.append(step)
+                    group.append(step.id)
+                previous = group or previous
+            else:
+                action = InitStep.parse_action(**entry)
+                if action is None:
+                    continue
+                step = InitStep(
+                    id=str(entry.get("id", f"step-{index}")),
+                    action=action,
+                    needs=InitStep.parse_needs(entry.get("needs", previous)),
+                )
+                steps.append(step)
+                previous = [step.id]
+
+        ids = [step.id for step in steps]
+        for step in steps:
+            if not STEP_ID.fullmatch(step.id):
+                raise ValueError(
+                    f"Invalid init step id {step.id}, use letters, digits, "
+                    "'_', '-' and '.'"
+                )
+            if ids.count(step.id) > 1:
+                raise ValueError(f"Duplicated init step id {step.id}")
+            for need in step.needs:
+                if need not in ids:
+                    raise ValueError(f"Init step {step.id} needs unknown step {need}")
+
+        # The scheduler imports this module, import it once both are loaded
+        from revel.scheduler import order
+
+        # Fail on circular needs when loading, before a run touches anything
+        order(steps)
+
+        return steps
+
+
 @dataclass
 class Instance:
     ami: str
@@ -40,33 +169,20 @@ class Instance:
     public: bool = True  # TODO: Review if we can make it with SSM
     size: str = "t3.micro"
     disk: Optional[Disk] = None
+    volumes: list[Disk] = field(default_factory=list[Disk])
+    scratch: Optional[str] = "/scratch"
+    cache: Optional[Disk] = None
     backups: bool = False
     auto_shutdown: bool = True
-    init: list[Init] = field(default_factory=list[Init])
-    sync: list[SyncFile] = field(default_factory=list[SyncFile])
+    hibernate: bool = False
+    init: list[InitStep] = field(default_factory=list[InitStep])
+    sync: list[SyncEntry] = field(default_factory=list[SyncEntry])
+    # Remote paths (src) fetched into local directories (dst)
+    pull: list[SyncEntry] = field(default_factory=list[SyncEntry])
 
     @staticmethod
     def parse(**kwargs) -> "Instance":
-        init: list[Init] = []
-        for i in kwargs.get("init", []):
-            if i.get("files", None):
-                # Create touple of files to sync
-                init_files = SyncFiles(
-                    [
-                        (file.split(":")[0], file.split(":")[1])
-                        for file in i.get("files")
-                    ]
-                )
-                init.append(init_files)
-            elif i.get("run", None):
-                run = i.get("run")
-                init.append(run)
-
-        sync: list[SyncFile] = []
-        for file in kwargs.get("sync", []):
-            # Create touple of files to sync
-            sync_files = (file.split(":")[0], file.split(":")[1])
-            sync.append(sync_files)
+        init = InitStep.parse_steps(kwargs.get("init", []))
 
         return Instance(
             ami=kwargs.get("ami", None),
@@ -76,11 +192,20 @@ class Instance:
             profile=kwargs.get("profile", None),
             public=kwargs.get("public", None),
             size=kwargs.get("size", None),
-            disk=kwargs.get("disk", None),
+            disk=Disk.parse(**kwargs["disk"]) if kwargs.get("disk") else None,
+            volumes=[Disk.parse(**volume) for volume in kwargs.get("volumes", [])],
+            scratch=kwargs.get("scratch", "/scratch"),
+            cache=(
+                Disk.parse(**{"mount": "/cache", **kwargs["cache"]})
+                if kwargs.get("cache")
+                else None
+            ),
             backups=kwargs.get("backups", None),
             auto_shutdown=kwargs.get("auto_shutdown", None),
+            hibernate=kwargs.get("hibernate", False),
             init=init,
-            sync=sync,
+            sync=[SyncEntry.parse(entry) for entry in kwargs.get("sync", [])],
+            pull=[SyncEntry.parse(entry) for entry in kwargs.get("pull", [])],
         )
 
 
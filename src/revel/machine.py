@@ -1,13 +1,51 @@
-from dataclasses import dataclass
+import time
+import uuid
+from dataclasses import dataclass, replace
 from enum import Enum
+from math import ceil
 from pathlib import Path
-from typing import Any, Optional, cast
+from typing import Any, Callable, List, Optional, Sequence
 
 import yaml
-from botocore.exceptions import ClientError
-from mypy_boto3_ec2.literals import InstanceTypeType, VolumeTypeType
-from mypy_boto3_ec2.service_resource import EC2ServiceResource, Instance
-from mypy_boto3_ec2.type_defs import BlockDeviceMappingTypeDef, EbsBlockDeviceTypeDef
+
+from revel.catalog import Catalog
+from revel.config import Disk, DiskType
+from revel.providers.base import (
+    HIBERNATE_REASON,
+    RUNNING,
+    STOPPED,
+    TERMINATED,
+    InstanceInfo,
+    InstanceNotFound,
+    InstanceSpec,
+    Provider,
+    VolumeInfo,
+)
+from revel.userdata import user_data
+
+CACHE_DEVICE = "/dev/sdz"
+CACHE_TAG = "revel:cache"
+OWNER_FILE = ".owner"
+
+
+def state_owner(state_dir: Path) -> str:
+    """Return the ID of the state dir, created on first use.
+
+    Cache volumes are tagged with it so state dirs sharing an account, or
+    teammates using the same machine names, never pick each other's volumes.
+    """
+    path = state_dir / OWNER_FILE
+    try:
+        return path.read_text().strip()
+    except OSError:
+        state_dir.mkdir(parents=True, exist_ok=True)
+        owner = uuid.uuid4().hex[:12]
+        path.write_text(f"{owner}\n")
+        return owner
+
+
+def cache_tag(owner: str, name: str) -> str:
+    return f"{owner}/{name}"
 
 
 class MachineState(str, Enum):
@@ -22,7 +60,9 @@ class MachineState(str, Enum):
     UNKNOWN = "UNKNOWN"
 
     @classmethod
-    def from_instance_state(cls, state: Optional[str]) -> "MachineState":
+    def from_instance_state(
+        cls, state: Optional[str], reason: Optional[str] = None
+    ) -> "MachineState":
         instance_state_map = {
             "pending": cls.PENDING,
             "running": cls.RUNNING,
@@ -35,6 +75,10 @@ class MachineState(str, Enum):
         if not state:
             return cls.UNKNOWN
 
+        # Hibernated instances are reported as stopped
+        if state == "stopped" and reason == HIBERNATE_REASON:
+            return cls.SUSPENDED
+
         return instance_state_map.get(state, cls.UNKNOWN)
 
 
@@ -47,6 +91,10 @@ class Machine:
     private_ip_address: Optional[str] = None
     state: MachineState = MachineState.CREATING
     id: Optional[str] = None
+    cache_volume_id: Optional[str] = None
+    instance_type: Optional[str] = None
+    image: Optional[str] = None
+    hibernate: bool = False
 
     @classmethod
     def from_object(cls, **kwargs) -> "Machine":
@@ -58,6 +106,10 @@ class Machine:
             private_ip_address=kwargs["private_ip_address"],
             state=MachineState(kwargs["state"]),
             id=kwargs["id"],
+            cache_volume_id=kwargs.get("cache_volume_id", None),
+            instance_type=kwargs.get("instance_type", None),
+            image=kwargs.get("image", None),
+            hibernate=kwargs.get("hibernate", False),
         )
 
     def to_dict(
@@ -71,21 +123,25 @@ class Machine:
             "private_ip_address": self.private_ip_address,
             "state": self.state.value,
             "id": self.id,
+            "cache_volume_id": self.cache_volume_id,
+            "instance_type": self.instance_type,
+            "image": self.image,
+            "hibernate": self.hibernate,
         }
 
 
 class MachineManager:
     machine_state_dir: Path
     machine: Machine
-    ec2: EC2ServiceResource
+    provider: Provider
 
     def __init__(
         self,
         machine_state_dir: Path,
         name: str,
-        ec2: EC2ServiceResource,
+        provider: Provider,
     ) -> None:
-        self.ec2 = ec2
+        self.provider = provider
         self.machine_state_dir = machine_state_dir
         self.machine = Machine(name=name)
 
@@ -100,13 +156,19 @@ class MachineManager:
 
         return Path(f"{self.machine_state_dir}/{self.machine.name}.yml")
 
+    def _get_id(self) -> str:
+        if not self.machine.id:
+            raise ValueError(f"Unable to find machine ID for {self.machine.name}")
+
+        return self.machine.id
+
     @staticmethod
     def list(
         machine_state_dir: Path,
-        ec2: EC2ServiceResource,
+        provider: Provider,
     ) -> list["MachineManager"]:
         return [
-            MachineManager(machine_state_dir, file.with_suffix("").name, ec2)
+            MachineManager(machine_state_dir, file.with_suffix("").name, provider)
             for file in machine_state_dir.glob("*.yml")
             if file.is_file()
         ]
@@ -120,7 +182,7 @@ class MachineManager:
 
     def update(
         self,
-        instance: Optional[Instance] = None,
+        instance: Optional[InstanceInfo] = None,
         state: Optional[MachineState] = None,
         persist: bool = True,
     ) -> None:
@@ -133,22 +195,73 @@ class MachineManager:
             self.machine.state = state
         elif instance:
             self.machine.state = MachineState.from_instance_state(
-                instance.state.get("Name")
+                instance.state, instance.reason
             )
 
         if persist:
             self.save()
 
-    def refresh(self) -> Machine:
-        self.load()
-        if self.machine.id:
-            id = self.machine.id
-        else:
-            raise ValueError("Machine ID not found")
+    @staticmethod
+    def created(managers: Sequence["MachineManager"]) -> List["MachineManager"]:
+        """Return the managers with an instance.
 
-        instance = self.ec2.Instance(id)
+        State is saved before launching, so a failed create leaves a machine
+        without one, batch operations leave those out.
+        """
+        return [manager for manager in managers if manager.machine.id]
 
-        self.update(instance=instance)
+    @staticmethod
+    def _for_existing(
+        managers: Sequence["MachineManager"], action: Callable[[List[str]], None]
+    ) -> List["MachineManager"]:
+        """Run action with the instance IDs of managers, returning the ones used.
+
+        An instance deleted outside revel fails the whole request, in that case
+        the missing ones are marked terminated and action runs without them.
+        """
+        managers = MachineManager.created(managers)
+        if not managers:
+            return managers
+
+        try:
+            action([manager._get_id() for manager in managers])
+        except InstanceNotFound:
+            MachineManager.refresh_many(managers)
+            managers = [
+                manager
+                for manager in managers
+                if manager.machine.state != MachineState.TERMINATED
+            ]
+            if managers:
+                action([manager._get_id() for manager in managers])
+
+        return managers
+
+    @staticmethod
+    def refresh_many(managers: Sequence["MachineManager"]) -> None:
+        """Refresh machines with a single describe call."""
+        for manager in managers:
+            manager.load()
+        managers = MachineManager.created(managers)
+        if not managers:
+            return
+
+        instances = {
+            instance.id: instance
+            for instance in managers[0].provider.describe(
+                [manager._get_id() for manager in managers]
+            )
+        }
+        for manager in managers:
+            instance = instances.get(manager._get_id())
+            if instance:
+                manager.update(instance=instance)
+            else:
+                # Terminated instances eventually disappear from the provider
+                manager.update(state=MachineState.TERMINATED)
+
+    def refresh(self) -> Machine:
+        MachineManager.refresh_many([self])
         return self.machine
 
     def load(self) -> Machine:
@@ -178,6 +291,69 @@ class MachineManager:
         except ValueError:
             return None
 
+    @staticmethod
+    def list_cache_volumes(
+        provider: Provider, owner: Optional[str] = None
+    ) -> List[VolumeInfo]:
+        """List cache volumes, only the ones of owner if given."""
+        volumes = provider.describe_volumes(tags={CACHE_TAG: None})
+        if owner is None:
+            return volumes
+        return [v for v in volumes if v.tags[CACHE_TAG].startswith(f"{owner}/")]
+
+    def _cache_tag(self) -> str:
+        return cache_tag(state_owner(self.machine_state_dir), self.machine.name)
+
+    def get_cache_volume(self) -> Optional[VolumeInfo]:
+        """Return the cache volume of the machine if it can be attached to it.
+
+        Raises ValueError if it is attached to another instance.
+        """
+        volumes = self.provider.describe_volumes(tags={CACHE_TAG: self._cache_tag()})
+        for volume in volumes:
+            if volume.state == "available" or self.machine.id in volume.attachments:
+                return volume
+        for volume in volumes:
+            if volume.attachments:
+                raise ValueError(
+                    f"Cache volume {volume.id} of {self.machine.name} is attached "
+                    f"to {', '.join(volume.attachments)}"
+                )
+        return None
+
+    def _create_cache_volume(self, cache: Disk) -> VolumeInfo:
+        volume = self.provider.create_volume(
+            cache,
+            zone=self.provider.zones()[0],
+            tags={"Name": f"{self.machine.name}-cache", CACHE_TAG: self._cache_tag()},
+        )
+        self.provider.wait_volumes([volume.id], "available")
+        return volume
+
+    def attach_cache_volume(self) -> None:
+        if not self.machine.id or not self.machine.cache_volume_id:
+            return
+
+        volumes = self.provider.describe_volumes(ids=[self.machine.cache_volume_id])
+        if not volumes or self.machine.id in volumes[0].attachments:
+            return
+
+        self.provider.attach_volume(volumes[0].id, self.machine.id, CACHE_DEVICE)
+        self.provider.wait_volumes([volumes[0].id], "in-use")
+
+    def _hibernation_memory(self, instance_type: str) -> int:
+        """Return the memory in MiB of instance_type if it supports hibernation."""
+        catalog = Catalog(self.machine_state_dir, self.provider)
+        info = catalog.instance_types([instance_type]).get(instance_type)
+        if not info:
+            raise ValueError(f"Unknown instance type {instance_type}")
+        if info.hibernation is False:
+            raise ValueError(
+                f"Instance type {instance_type} does not support hibernation"
+            )
+
+        return info.memory
+
     def create(
         self,
         ami: str,
@@ -188,90 +364,180 @@ class MachineManager:
         volume_name: str = "/dev/sda1",
         volume_size: int = 10,
         volume_type: str = "gp3",
+        disk: Optional[Disk] = None,
+        # NOTE: Using List instead of list because it is shadowed by list()
+        volumes: Optional[List[Disk]] = None,
+        scratch: Optional[str] = None,
+        cache: Optional[Disk] = None,
+        hibernate: bool = False,
     ) -> Machine:
         if port:
             self.machine.port = port
         if user:
             self.machine.user = user
 
+        root = disk or Disk(type=DiskType(volume_type.upper()), size=volume_size)
+        if hibernate:
+            # RAM is written to the root volume on hibernation, it has to be big
+            # enough to hold it.
+            memory = self._hibernation_memory(instance_type)
+            root = replace(root, size=root.size + ceil(memory / 1024))
+
+        devices = [(volume_name, root)]
+        mounts: list[tuple[str, str]] = []
+        for index, volume in enumerate(volumes or []):
+            # Data volumes default to /dev/sdf onwards, as recommended by AWS
+            device = volume.device or f"/dev/sd{chr(ord('f') + index)}"
+            devices.append((device, volume))
+            if volume.mount:
+                mounts.append((device, volume.mount))
+
+        zone = None
+        if cache:
+            # The cache volume outlives the instance, so the instance is placed
+            # in its availability zone to be able to attach it.
+            cache_volume = self.get_cache_volume() or self._create_cache_volume(cache)
+            self.machine.cache_volume_id = cache_volume.id
+            zone = cache_volume.zone
+            mounts.append((CACHE_DEVICE, cache.mount or "/cache"))
+
         # Create a single instance
+        self.machine.instance_type = instance_type
+        self.machine.image = ami
+        self.machine.hibernate = hibernate
         self.save()
-        # TODO: Can we avoid casting?
-        instances = self.ec2.create_instances(
-            MaxCount=1,
-            MinCount=1,
-            ImageId=ami,
-            InstanceType=cast(InstanceTypeType, instance_type),
-            KeyName=key_name,
-            Monitoring={"Enabled": True},
-            EbsOptimized=True,
-            BlockDeviceMappings=[
-                BlockDeviceMappingTypeDef(
-                    DeviceName=volume_name,
-                    Ebs=EbsBlockDeviceTypeDef(
-                        DeleteOnTermination=True,
-                        VolumeSize=volume_size,
-                        VolumeType=cast(VolumeTypeType, volume_type),
-                    ),
-                )
-            ],
-            TagSpecifications=[
-                {
-                    "ResourceType": "instance",
-                    "Tags": [{"Key": "Name", "Value": self.machine.name}],
-                },
-                {
-                    "ResourceType": "volume",
-                    "Tags": [{"Key": "Name", "Value": self.machine.name}],
-                },
-            ],
-        )
-        instance: Instance = instances[0]
+        instance = self.provider.create(
+            InstanceSpec(
+                name=self.machine.name,
+                image=ami,
+                instance_type=instance_type,
+                key_name=key_name,
+                devices=devices,
+                user_data=user_data(self.machine.user, mounts, scratch),
+                zone=zone,
+                hibernate=hibernate,
+            )
+        )[0]
         self.update(instance, state=MachineState.CREATING)
 
-        instance.wait_until_running()
+        try:
+            self.provider.wait([instance.id], RUNNING)
+            self.attach_cache_volume()
+        except Exception as e:
+            # Do not leak an instance that is not usable as configured
+            self.provider.terminate([instance.id])
+            self.remove()
+            raise e
         return self.refresh()
 
     def destroy(self) -> None:
-        if not self.machine.id:
-            raise ValueError(f"Unable to find machine ID for {self.machine.name}")
+        if not self.machine.id and self._get_machine_state_path().exists():
+            # Left by a failed create, there is no instance to terminate
+            self.remove()
+            return
 
-        instance = self.ec2.Instance(self.machine.id)
+        id = self._get_id()
         try:
-            instance.terminate()
-        except ClientError as e:
-            code = e.response.get("Error", {}).get("Code", None)
-            # InvalidInstanceID.Malformed is returned when instance cannot be found 🤷
-            if code in ["InvalidInstanceID.NotFound", "InvalidInstanceID.Malformed"]:
-                self.remove()
-            else:
-                raise e
-
-        self.update(instance, state=MachineState.TERMINATING)
-        instance.wait_until_terminated()
+            self.provider.terminate([id])
+        except InstanceNotFound:
+            self.remove()
+            return
+
+        self.update(state=MachineState.TERMINATING)
+        self.provider.wait([id], TERMINATED)
+        if self.machine.cache_volume_id:
+            # Attached volumes are not deleted on termination, wait for the
+            # cache volume to be released so it can be reattached on create.
+            self.provider.wait_volumes([self.machine.cache_volume_id], "available")
         self.remove()
 
-    def stop(self) -> None:
-        if not self.machine.id:
-            raise ValueError(f"Unable to find machine ID for {self.machine.name}")
+    @staticmethod
+    def stop_many(
+        managers: Sequence["MachineManager"], hibernate: bool = False
+    ) -> None:
+        if not managers:
+            return
 
-        instance = self.ec2.Instance(self.machine.id)
+        provider = managers[0].provider
+        managers = MachineManager._for_existing(
+            managers, lambda ids: provider.stop(ids, hibernate=hibernate)
+        )
+        if not managers:
+            return
 
-        instance.stop()
-        instance.wait_until_stopped()
-        self.refresh()
-        self.update(state=MachineState.STOPPED)
+        provider.wait([manager._get_id() for manager in managers], STOPPED)
+        # The state reason tells if the instance was actually hibernated
+        MachineManager.refresh_many(managers)
 
-    def start(self) -> None:
-        if not self.machine.id:
-            raise ValueError(f"Unable to find machine ID for {self.machine.name}")
+    @staticmethod
+    def start_many(managers: Sequence["MachineManager"]) -> None:
+        if not managers:
+            return
+
+        provider = managers[0].provider
+
+        def start(ids: List[str]) -> None:
+            for manager in managers:
+                if manager.machine.id in ids:
+                    manager.attach_cache_volume()
+            provider.start(ids)
+
+        managers = MachineManager._for_existing(managers, start)
+        if not managers:
+            return
+
+        provider.wait([manager._get_id() for manager in managers], RUNNING)
+        MachineManager.refresh_many(managers)
+        for manager in managers:
+            manager.update(state=MachineState.RUNNING)
+
+    def wake(
+        self,
+        progress: Optional[Callable[[str], None]] = None,
+        poll: float = 1.0,
+        timeout: float = 600.0,
+    ) -> Machine:
+        """Start the machine, returning as soon as it is running with a public IP.
+
+        Unlike start() this does not wait for the full instance status checks,
+        which take much longer than the instance to accept connections.
+        """
+        id = self._get_id()
+        self.attach_cache_volume()
+        self.provider.start([id])
+        self.update(state=MachineState.PENDING)
+
+        deadline = time.monotonic() + timeout
+        while True:
+            instances = self.provider.describe([id])
+            if not instances:
+                raise ValueError(f"Unable to find instance {id}")
+            if instances[0].state == RUNNING and instances[0].public_ip_address:
+                break
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Timed out waiting for {self.machine.name}")
+            if progress:
+                progress(f"Instance {self.machine.name} is {instances[0].state}")
+            time.sleep(poll)
+
+        self.update(instances[0])
+        return self.machine
 
-        instance = self.ec2.Instance(self.machine.id)
+    @staticmethod
+    def suspend_many(managers: Sequence["MachineManager"]) -> None:
+        """Hibernate machines, all of them must have been launched for it."""
+        for manager in MachineManager.created(managers):
+            if not manager.machine.hibernate:
+                raise ValueError(
+                    f"Machine {manager.machine.name} was not launched with hibernation"
+                )
+        MachineManager.stop_many(managers, hibernate=True)
 
-        instance.start()
-        instance.wait_until_running()
-        self.refresh()
-        self.update(state=MachineState.RUNNING)
+    def stop(self) -> None:
+        MachineManager.stop_many([self])
+
+    def start(self) -> None:
+        MachineManager.start_many([self])
 
     def suspend(self) -> None:
-        raise NotImplementedError("Not implemented")
+        MachineManager.suspend_many([self])
@@ -0,0 +1,189 @@
+"""Operation metrics.
+
+Every tracked command appends a JSON record to a log in the state dir, rotated
+once it grows past MAX_BYTES. Records are aggregated into latency percentiles
+and exported in the Prometheus text format, for the node exporter textfile
+collector, along with the number of machines in each state. Aggregates cover
+the records still in the log, so they are exported as gauges and go down as
+the log rotates.
+"""
+
+import json
+import time
+from collections import Counter, defaultdict
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Optional
+
+METRICS_FILE = ".metrics.jsonl"
+MAX_BYTES = 1024 * 1024
+BACKUP_COUNT = 3
+
+OK = "ok"
+ERROR = "error"
+# Commands that exited early without doing anything, e.g. an unknown machine
+SKIPPED = "skipped"
+
+QUANTILES = [0.5, 0.95, 0.99]
+
+
+@dataclass
+class Record:
+    operation: str
+    machine: str
+    started: float
+    duration: float = 0.0
+    api_calls: int = 0
+    bytes_synced: int = 0
+    outcome: str = OK
+    region: Optional[str] = None
+
+
+def _path(state_dir: Path, index: int = 0) -> Path:
+    path = state_dir / METRICS_FILE
+    return path.with_name(f"{path.name}.{index}") if index else path
+
+
+def _rotate(state_dir: Path) -> None:
+    for index in range(BACKUP_COUNT, 0, -1):
+        source = _path(state_dir, index - 1)
+        if source.exists():
+            source.replace(_path(state_dir, index))
+
+
+def append(state_dir: Path, record: Record) -> None:
+    path = _path(state_dir)
+    try:
+        if path.exists() and path.stat().st_size >= MAX_BYTES:
+            _rotate(state_dir)
+        state_dir.mkdir(parents=True, exist_ok=True)
+        with path.open("a") as log:
+            log.write(json.dumps(asdict(record)) + "\n")
+    except OSError:
+        # Metrics are best effort, never fail the operation because of them
+        pass
+
+
+def read(state_dir: Path, since: Optional[float] = None) -> list[Record]:
+    """Read the records of all the logs, oldest first."""
+    records = []
+    for index in range(BACKUP_COUNT, -1, -1):
+        path = _path(state_dir, index)
+        if not path.exists():
+            continue
+        for line in path.read_text().splitlines():
+            try:
+                record = Record(**json.loads(line))
+            except (TypeError, ValueError):
+                # Skip lines truncated by a concurrent write
+                continue
+            if since is None or record.started >= since:
+                records.append(record)
+
+    return records
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Return the q quantile of values, interpolating between ranks."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = q * (len(ordered) - 1)
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def _completed(records: list[Record]) -> list[Record]:
+    # Skipped runs take no time and would drag the percentiles down
+    return [record for record in records if record.outcome != SKIPPED]
+
+
+def summarize(records: list[Record], by: str = "operation") -> list[list[Any]]:
+    """Aggregate the records of completed runs grouped by a record field.
+
+    Rows hold the group, count, errors, p50, p95, p99 and max duration, the
+    average API calls and the total bytes synced.
+    """
+    groups: dict[str, list[Record]] = defaultdict(list)
+    for record in _completed(records):
+        groups[str(getattr(record, by))].append(record)
+
+    rows = []
+    for group, items in sorted(groups.items()):
+        durations = [record.duration for record in items]
+        rows.append(
+            [
+                group,
+                len(items),
+                sum(record.outcome == ERROR for record in items),
+                *(round(percentile(durations, q), 2) for q in QUANTILES),
+                round(max(durations), 2),
+                round(sum(record.api_calls for record in items) / len(items), 1),
+                sum(record.bytes_synced for record in items),
+            ]
+        )
+
+    return rows
+
+
+def prometheus(records: list[Record], states: Counter[str]) -> str:
+    """Render records and machine state counts in the Prometheus text format."""
+    lines = [
+        "# HELP revel_machines Machines by state.",
+        "# TYPE revel_machines gauge",
+    ]
+    lines += [
+        f'revel_machines{{state="{state.lower()}"}} {count}'
+        for state, count in sorted(states.items())
+    ]
+
+    operations: dict[str, list[Record]] = defaultdict(list)
+    for record in _completed(records):
+        operations[record.operation].append(record)
+
+    lines += [
+        "# HELP revel_operation_duration_seconds Duration quantiles of the "
+        "revel operations in the metrics log.",
+        "# TYPE revel_operation_duration_seconds gauge",
+    ]
+    for operation, items in sorted(operations.items()):
+        durations = [record.duration for record in items]
+        lines += [
+            f'revel_operation_duration_seconds{{operation="{operation}",'
+            f'quantile="{q}"}} {percentile(durations, q):.3f}'
+            for q in QUANTILES
+        ]
+
+    lines += [
+        "# HELP revel_operations Revel operations in the metrics log.",
+        "# TYPE revel_operations gauge",
+    ]
+    lines += [
+        f'revel_operations{{operation="{operation}"}} {len(items)}'
+        for operation, items in sorted(operations.items())
+    ]
+    lines += [
+        "# HELP revel_operation_errors Failed revel operations in the metrics log.",
+        "# TYPE revel_operation_errors gauge",
+    ]
+    lines += [
+        f'revel_operation_errors{{operation="{operation}"}} '
+        f"{sum(record.outcome == ERROR for record in items)}"
+        for operation, items in sorted(operations.items())
+    ]
+    lines += [
+        "# HELP revel_metrics_generated_seconds Time the metrics were generated.",
+        "# TYPE revel_metrics_generated_seconds gauge",
+        f"revel_metrics_generated_seconds {time.time():.0f}",
+    ]
+
+    return "".join(f"{line}\n" for line in lines)
+
+
+def write_textfile(path: Path, content: str) -> None:
+    """Write content atomically, the collector may read it at any time."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    tmp_path.write_text(content)
+    tmp_path.replace(path)
@@ -0,0 +1,185 @@
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Callable, Optional
+
+import boto3
+from botocore.config import Config as BotoConfig
+
+if TYPE_CHECKING:
+    from mypy_boto3_ec2.client import EC2Client
+
+THROTTLING_ERRORS = [
+    "RequestLimitExceeded",
+    "Throttling",
+    "ThrottlingException",
+    "TooManyRequestsException",
+]
+
+# Requests per second and burst size used per API action. EC2 throttles by
+# action category, mutating and resource intensive actions being the scarcest.
+DEFAULT_RATES: dict[str, tuple[float, float]] = {
+    "Describe": (10.0, 20.0),
+    "RunInstances": (2.0, 5.0),
+}
+DEFAULT_RATE = (5.0, 10.0)
+
+
+@dataclass
+class TokenBucket:
+    rate: float
+    capacity: float
+    clock: Callable[[], float] = time.monotonic
+    sleep: Callable[[float], None] = time.sleep
+    tokens: float = field(init=False)
+    updated: float = field(init=False)
+    lock: threading.Lock = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.tokens = self.capacity
+        self.updated = self.clock()
+        self.lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """Take tokens from the bucket, blocking until they are available.
+
+        Returns the time spent waiting.
+        """
+        waited = 0.0
+        with self.lock:
+            self._refill()
+            while self.tokens < tokens:
+                delay = (tokens - self.tokens) / self.rate
+                self.sleep(delay)
+                waited += delay
+                self._refill()
+            self.tokens -= tokens
+
+        return waited
+
+
+class RateLimiter:
+    """Client side rate limiter with one token bucket per API action.
+
+    throttled is the time spent waiting for local tokens plus the time spent
+    backing off before retrying throttled requests, measured from the
+    needs-retry event to the next attempt being sent.
+    """
+
+    buckets: dict[str, TokenBucket]
+    rate: Optional[float]
+    calls: int
+    retries: int
+    throttled: float
+    backoff: float
+
+    def __init__(
+        self, rate: Optional[float] = None, clock: Callable[[], float] = time.monotonic
+    ) -> None:
+        self.rate = rate
+        self.buckets = {}
+        self.calls = 0
+        self.retries = 0
+        self.throttled = 0.0
+        self.backoff = 0.0
+        self.clock = clock
+        self._lock = threading.Lock()
+        # Retries happen in the thread of the call, track them per thread
+        self._local = threading.local()
+
+    def _bucket(self, action: str) -> TokenBucket:
+        with self._lock:
+            if action not in self.buckets:
+                if self.rate:
+                    # A burst below one token could never be acquired
+                    rate, burst = self.rate, max(1.0, self.rate * 2)
+                else:
+                    rate, burst = next(
+                        (v for k, v in DEFAULT_RATES.items() if action.startswith(k)),
+                        DEFAULT_RATE,
+                    )
+                self.buckets[action] = TokenBucket(rate=rate, capacity=burst)
+            return self.buckets[action]
+
+    def acquire(self, action: str) -> None:
+        waited = self._bucket(action).acquire()
+        with self._lock:
+            self.calls += 1
+            self.throttled += waited
+
+    def _before_call(self, model: Any, **kwargs) -> None:
+        self.acquire(model.name)
+
+    def _needs_retry(self, response: Any = None, **kwargs) -> None:
+        if not response:
+            return
+        code = response[1].get("Error", {}).get("Code")
+        if code in THROTTLING_ERRORS:
+            with self._lock:
+                self.retries += 1
+            self._local.backoff_started = self.clock()
+
+    def _before_send(self, **kwargs) -> None:
+        started = getattr(self._local, "backoff_started", None)
+        if started is None:
+            return
+        self._local.backoff_started = None
+        waited = self.clock() - started
+        with self._lock:
+            self.backoff += waited
+            self.throttled += waited
+
+    def _after_call(self, **kwargs) -> None:
+        # The last throttled attempt is not retried, forget its backoff so the
+        # next send of this thread is not counted as backing off
+        self._local.backoff_started = None
+
+    def register(self, events: Any, service: str = "ec2") -> None:
+        events.register(f"before-call.{service}", self._before_call)
+        events.register(f"needs-retry.{service}", self._needs_retry)
+        events.register(f"before-send.{service}", self._before_send)
+        events.register(f"after-call.{service}", self._after_call)
+        events.register(f"after-call-error.{service}", self._after_call)
+
+    def report(self) -> Optional[str]:
+        if not self.throttled and not self.retries:
+            return None
+        return (
+            f"Throttled for {self.throttled:.1f}s over {self.calls} API calls"
+            f" ({self.retries} throttling retries, {self.backoff:.1f}s backing off)"
+        )
+
+
+class AWS:
+    """Shared AWS session with adaptive retries and client side rate limiting."""
+
+    session: boto3.Session
+    config: BotoConfig
+    limiter: RateLimiter
+
+    def __init__(
+        self,
+        profile: Optional[str] = None,
+        max_attempts: int = 10,
+        max_pool_connections: int = 10,
+        rate: Optional[float] = None,
+    ) -> None:
+        self.session = boto3.Session(profile_name=profile)
+        self.config = BotoConfig(
+            retries={"mode": "adaptive", "max_attempts": max_attempts},
+            max_pool_connections=max_pool_connections,
+        )
+        self.limiter = RateLimiter(rate=rate)
+        self._ec2: Optional["EC2Client"] = None
+
+    @property
+    def ec2(self) -> "EC2Client":
+        if not self._ec2:
+            self._ec2 = self.session.client("ec2", config=self.config)
+            self.limiter.register(self._ec2.meta.events)
+        return self._ec2
@@ -0,0 +1,158 @@
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import Optional, TypeVar
+
+from revel.config import Disk
+
+# Instance lifecycle states, following the EC2 naming
+PENDING = "pending"
+RUNNING = "running"
+STOPPING = "stopping"
+STOPPED = "stopped"
+SHUTTING_DOWN = "shutting-down"
+TERMINATED = "terminated"
+
+# State reason of instances stopped through hibernation
+HIBERNATE_REASON = "Client.UserInitiatedHibernate"
+
+# Instances handled per request in batch operations. EC2 accepts up to 200
+# values per filter, keep well below to bound the request size.
+BATCH_SIZE = 100
+
+T = TypeVar("T")
+
+
+def chunks(items: list[T], size: int) -> list[list[T]]:
+    return [items[i : i + size] for i in range(0, len(items), size)]
+
+
+class ProviderError(Exception):
+    pass
+
+
+class InstanceNotFound(ProviderError):
+    pass
+
+
+@dataclass
+class InstanceInfo:
+    id: str
+    state: str
+    reason: Optional[str] = None
+    public_ip_address: Optional[str] = None
+    private_ip_address: Optional[str] = None
+
+
+@dataclass
+class InstanceSpec:
+    name: str
+    image: str
+    instance_type: str
+    key_name: str
+    # (device, disk) pairs, the first one being the root volume
+    devices: list[tuple[str, Disk]] = field(default_factory=list[tuple[str, Disk]])
+    user_data: Optional[str] = None
+    zone: Optional[str] = None
+    hibernate: bool = False
+
+
+@dataclass
+class InstanceTypeInfo:
+    name: str
+    vcpus: int
+    memory: int  # MiB
+    architectures: list[str] = field(default_factory=list[str])
+    instance_storage: int = 0  # GB
+    hibernation: Optional[bool] = None
+
+
+@dataclass
+class ImageInfo:
+    id: str
+    architecture: str
+    name: Optional[str] = None
+
+
+@dataclass
+class VolumeInfo:
+    id: str
+    zone: str
+    size: int
+    type: str
+    state: str
+    attachments: list[str] = field(default_factory=list[str])
+    tags: dict[str, str] = field(default_factory=dict[str, str])
+
+
+class Provider(ABC):
+    """Compute provider used by MachineManager.
+
+    Instance operations are batch first, taking many IDs at once so fleet
+    operations cost a single round trip where the backend allows it.
+    """
+
+    @abstractmethod
+    def create(self, spec: InstanceSpec, count: int = 1) -> list[InstanceInfo]:
+        """Launch count instances from spec."""
+
+    @abstractmethod
+    def describe(self, ids: list[str]) -> list[InstanceInfo]:
+        """Describe instances, IDs that do not exist are left out."""
+
+    @abstractmethod
+    def start(self, ids: list[str]) -> None:
+        """Start stopped or hibernated instances.
+
+        Raises InstanceNotFound if any of the IDs is unknown.
+        """
+
+    @abstractmethod
+    def stop(self, ids: list[str], hibernate: bool = False) -> None:
+        """Stop instances, hibernating them if requested.
+
+        Raises InstanceNotFound if any of the IDs is unknown.
+        """
+
+    @abstractmethod
+    def terminate(self, ids: list[str]) -> None:
+        """Terminate instances, raising InstanceNotFound for unknown IDs."""
+
+    @abstractmethod
+    def wait(self, ids: list[str], state: str) -> None:
+        """Block until all instances reach state."""
+
+    @abstractmethod
+    def describe_instance_types(self, types: list[str]) -> list[InstanceTypeInfo]:
+        """Describe instance types, unknown types are left out."""
+
+    @abstractmethod
+    def describe_images(self, ids: list[str]) -> list[ImageInfo]:
+        """Describe images, unknown IDs are left out."""
+
+    @abstractmethod
+    def zones(self) -> list[str]:
+        """List the available zones."""
+
+    @abstractmethod
+    def create_volume(self, disk: Disk, zone: str, tags: dict[str, str]) -> VolumeInfo:
+        """Create a volume that is not attached to any instance."""
+
+    @abstractmethod
+    def describe_volumes(
+        self,
+        ids: Optional[list[str]] = None,
+        tags: Optional[dict[str, Optional[str]]] = None,
+    ) -> list[VolumeInfo]:
+        """Describe volumes by ID and/or tags, a None tag value matches any."""
+
+    @abstractmethod
+    def attach_volume(self, volume_id: str, instance_id: str, device: str) -> None:
+        """Attach a volume to an instance as device."""
+
+    @abstractmethod
+    def delete_volume(self, volume_id: str) -> None:
+        """Delete a detached volume."""
+
+    @abstractmethod
+    def wait_volumes(self, ids: list[str], state: str) -> None:
+        """Block until all volumes reach state."""
@@ -0,0 +1,308 @@
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Iterator, Optional, cast
+
+from botocore.exceptions import ClientError
+
+from revel.config import Disk, DiskType
+from revel.providers.base import (
+    BATCH_SIZE,
+    ImageInfo,
+    InstanceInfo,
+    InstanceNotFound,
+    InstanceSpec,
+    InstanceTypeInfo,
+    Provider,
+    VolumeInfo,
+    chunks,
+)
+
+if TYPE_CHECKING:
+    # The boto3 stubs are a development dependency
+    from mypy_boto3_ec2.client import EC2Client
+    from mypy_boto3_ec2.literals import InstanceTypeType, VolumeTypeType
+    from mypy_boto3_ec2.type_defs import (
+        BlockDeviceMappingTypeDef,
+        EbsBlockDeviceTypeDef,
+        FilterTypeDef,
+        ImageTypeDef,
+        InstanceTypeDef,
+        InstanceTypeInfoTypeDef,
+        VolumeTypeDef,
+    )
+
+# Provisioned IOPS used for io1/io2 volumes that do not configure them, matching
+# the gp3 baseline, within the IOPS per GiB each type allows.
+DEFAULT_IOPS = 3000
+MIN_IOPS = 100
+MAX_IOPS_PER_GIB = {DiskType.IO1: 50, DiskType.IO2: 500}
+
+NOT_FOUND_ERRORS = ["InvalidInstanceID.NotFound", "InvalidInstanceID.Malformed"]
+
+INVALID_INSTANCE_TYPE_ERRORS = ["InvalidInstanceType", "InvalidInstanceType.NotFound"]
+
+INSTANCE_WAITERS = {
+    "running": "instance_running",
+    "stopped": "instance_stopped",
+    "terminated": "instance_terminated",
+}
+
+VOLUME_WAITERS = {
+    "available": "volume_available",
+    "in-use": "volume_in_use",
+}
+
+
+@contextmanager
+def instances_found() -> Iterator[None]:
+    """Raise InstanceNotFound for the errors of requests with unknown instances."""
+    try:
+        yield
+    except ClientError as e:
+        code = e.response.get("Error", {}).get("Code", None)
+        # InvalidInstanceID.Malformed is returned when instance cannot be found 🤷
+        if code in NOT_FOUND_ERRORS:
+            raise InstanceNotFound(str(e)) from e
+        raise e
+
+
+def default_iops(disk: Disk) -> int:
+    ratio = MAX_IOPS_PER_GIB[disk.type]
+    return max(MIN_IOPS, min(DEFAULT_IOPS, ratio * disk.size))
+
+
+def block_device(device: str, disk: Disk) -> "BlockDeviceMappingTypeDef":
+    ebs: "EbsBlockDeviceTypeDef" = {
+        "DeleteOnTermination": True,
+        "VolumeSize": disk.size,
+        "VolumeType": cast("VolumeTypeType", disk.type.value.lower()),
+    }
+    if disk.type in [DiskType.IO1, DiskType.IO2]:
+        ebs["Iops"] = disk.iops or default_iops(disk)
+    elif disk.type == DiskType.GP3:
+        if disk.iops:
+            ebs["Iops"] = disk.iops
+        if disk.throughput:
+            ebs["Throughput"] = disk.throughput
+
+    return {"DeviceName": device, "Ebs": ebs}
+
+
+class EC2Provider(Provider):
+    client: "EC2Client"
+
+    def __init__(self, client: "EC2Client") -> None:
+        self.client = client
+
+    @staticmethod
+    def _instance(instance: "InstanceTypeDef") -> InstanceInfo:
+        return InstanceInfo(
+            id=instance["InstanceId"],
+            state=instance["State"]["Name"],
+            reason=instance.get("StateReason", {}).get("Code"),
+            public_ip_address=instance.get("PublicIpAddress"),
+            private_ip_address=instance.get("PrivateIpAddress"),
+        )
+
+    @staticmethod
+    def _instance_type(instance_type: "InstanceTypeInfoTypeDef") -> InstanceTypeInfo:
+        return InstanceTypeInfo(
+            name=instance_type["InstanceType"],
+            vcpus=instance_type["VCpuInfo"]["DefaultVCpus"],
+            memory=instance_type["MemoryInfo"]["SizeInMiB"],
+            architectures=list(
+                instance_type["ProcessorInfo"]["SupportedArchitectures"]
+            ),
+            instance_storage=instance_type.get("InstanceStorageInfo", {}).get(
+                "TotalSizeInGB", 0
+            ),
+            hibernation=instance_type.get("HibernationSupported"),
+        )
+
+    @staticmethod
+    def _image(image: "ImageTypeDef") -> ImageInfo:
+        return ImageInfo(
+            id=image["ImageId"],
+            architecture=image["Architecture"],
+            name=image.get("Name"),
+        )
+
+    @staticmethod
+    def _volume(volume: "VolumeTypeDef") -> VolumeInfo:
+        return VolumeInfo(
+            id=volume["VolumeId"],
+            zone=volume["AvailabilityZone"],
+            size=volume["Size"],
+            type=volume["VolumeType"],
+            state=volume["State"],
+            attachments=[a["InstanceId"] for a in volume.get("Attachments", [])],
+            tags={tag["Key"]: tag["Value"] for tag in volume.get("Tags", [])},
+        )
+
+    def create(self, spec: InstanceSpec, count: int = 1) -> list[InstanceInfo]:
+        extra: dict[str, Any] = {}
+        if spec.user_data:
+            extra["UserData"] = spec.user_data
+        if spec.zone:
+            extra["Placement"] = {"AvailabilityZone": spec.zone}
+        if spec.hibernate:
+            extra["HibernationOptions"] = {"Configured": True}
+
+        block_devices = [block_device(device, disk) for device, disk in spec.devices]
+        if spec.hibernate and block_devices:
+            # RAM is written to the root volume, which has to be encrypted
+            block_devices[0]["Ebs"]["Encrypted"] = True
+
+        # TODO: Can we avoid casting?
+        response = self.client.run_instances(
+            MaxCount=count,
+            MinCount=count,
+            ImageId=spec.image,
+            InstanceType=cast("InstanceTypeType", spec.instance_type),
+            KeyName=spec.key_name,
+            Monitoring={"Enabled": True},
+            EbsOptimized=True,
+            BlockDeviceMappings=block_devices,
+            TagSpecifications=[
+                {
+                    "ResourceType": "instance",
+                    "Tags": [{"Key": "Name", "Value": spec.name}],
+                },
+                {
+                    "ResourceType": "volume",
+                    "Tags": [{"Key": "Name", "Value": spec.name}],
+                },
+            ],
+            **extra,
+        )
+        return [self._instance(instance) for instance in response["Instances"]]
+
+    def describe(self, ids: list[str]) -> list[InstanceInfo]:
+        # Filtering by instance-id instead of passing InstanceIds skips unknown
+        # IDs rather than failing the whole batch.
+        paginator = self.client.get_paginator("describe_instances")
+        instances = []
+        for chunk in chunks(ids, BATCH_SIZE):
+            for page in paginator.paginate(
+                Filters=[{"Name": "instance-id", "Values": chunk}]
+            ):
+                for reservation in page["Reservations"]:
+                    instances += [self._instance(i) for i in reservation["Instances"]]
+
+        return instances
+
+    def start(self, ids: list[str]) -> None:
+        for chunk in chunks(ids, BATCH_SIZE):
+            with instances_found():
+                self.client.start_instances(InstanceIds=chunk)
+
+    def stop(self, ids: list[str], hibernate: bool = False) -> None:
+        for chunk in chunks(ids, BATCH_SIZE):
+            with instances_found():
+                self.client.stop_instances(InstanceIds=chunk, Hibernate=hibernate)
+
+    def terminate(self, ids: list[str]) -> None:
+        for chunk in chunks(ids, BATCH_SIZE):
+            with instances_found():
+                self.client.terminate_instances(InstanceIds=chunk)
+
+    def wait(self, ids: list[str], state: str) -> None:
+        waiter = self.client.get_waiter(INSTANCE_WAITERS[state])  # type: ignore
+        for chunk in chunks(ids, BATCH_SIZE):
+            waiter.wait(InstanceIds=chunk)
+
+    def describe_instance_types(self, types: list[str]) -> list[InstanceTypeInfo]:
+        instance_types = []
+        for chunk in chunks(types, BATCH_SIZE):
+            try:
+                response = self.client.describe_instance_types(
+                    InstanceTypes=[cast("InstanceTypeType", t) for t in chunk]
+                )
+            except ClientError as e:
+                code = e.response.get("Error", {}).get("Code", None)
+                if code not in INVALID_INSTANCE_TYPE_ERRORS:
+                    raise e
+                if len(chunk) > 1:
+                    # The whole request fails on any unknown type, retry one by
+                    # one to leave out only the unknown ones.
+                    for instance_type in chunk:
+                        instance_types += self.describe_instance_types([instance_type])
+                continue
+
+            instance_types += [
+                self._instance_type(t) for t in response["InstanceTypes"]
+            ]
+
+        return instance_types
+
+    def describe_images(self, ids: list[str]) -> list[ImageInfo]:
+        # Filtering by image-id skips unknown IDs like describe does
+        images = []
+        for chunk in chunks(ids, BATCH_SIZE):
+            response = self.client.describe_images(
+                Filters=[{"Name": "image-id", "Values": chunk}]
+            )
+            images += [self._image(image) for image in response["Images"]]
+
+        return images
+
+    def zones(self) -> list[str]:
+        response = self.client.describe_availability_zones(
+            Filters=[{"Name": "state", "Values": ["available"]}]
+        )
+        return [zone["ZoneName"] for zone in response["AvailabilityZones"]]
+
+    def create_volume(self, disk: Disk, zone: str, tags: dict[str, str]) -> VolumeInfo:
+        ebs = block_device("", disk)["Ebs"]
+        performance: dict[str, Any] = {
+            k: v for k, v in ebs.items() if k in ["Iops", "Throughput"]
+        }
+        volume = self.client.create_volume(
+            AvailabilityZone=zone,
+            Size=disk.size,
+            VolumeType=ebs["VolumeType"],
+            TagSpecifications=[
+                {
+                    "ResourceType": "volume",
+                    "Tags": [{"Key": k, "Value": v} for k, v in tags.items()],
+                }
+            ],
+            **performance,
+        )
+        return self._volume(cast("VolumeTypeDef", volume))
+
+    def describe_volumes(
+        self,
+        ids: Optional[list[str]] = None,
+        tags: Optional[dict[str, Optional[str]]] = None,
+    ) -> list[VolumeInfo]:
+        filters: list["FilterTypeDef"] = [
+            (
+                {"Name": f"tag:{k}", "Values": [v]}
+                if v is not None
+                else {"Name": "tag-key", "Values": [k]}
+            )
+            for k, v in (tags or {}).items()
+        ]
+        if ids:
+            filters.append({"Name": "volume-id", "Values": ids})
+
+        paginator = self.client.get_paginator("describe_volumes")
+        return [
+            self._volume(volume)
+            for page in paginator.paginate(Filters=filters)
+            for volume in page["Volumes"]
+        ]
+
+    def attach_volume(self, volume_id: str, instance_id: str, device: str) -> None:
+        with instances_found():
+            self.client.attach_volume(
+                VolumeId=volume_id, InstanceId=instance_id, Device=device
+            )
+
+    def delete_volume(self, volume_id: str) -> None:
+        self.client.delete_volume(VolumeId=volume_id)
+
+    def wait_volumes(self, ids: list[str], state: str) -> None:
+        waiter = self.client.get_waiter(VOLUME_WAITERS[state])  # type: ignore
+        for chunk in chunks(ids, BATCH_SIZE):
+            waiter.wait(VolumeIds=chunk)
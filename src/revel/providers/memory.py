@@ -0,0 +1,269 @@
+import threading
+import time
+from collections import Counter
+from dataclasses import replace
+from ipaddress import IPv4Address
+from typing import Optional
+
+from revel.config import Disk
+from revel.providers.base import (
+    HIBERNATE_REASON,
+    PENDING,
+    RUNNING,
+    SHUTTING_DOWN,
+    STOPPED,
+    STOPPING,
+    TERMINATED,
+    ImageInfo,
+    InstanceInfo,
+    InstanceNotFound,
+    InstanceSpec,
+    InstanceTypeInfo,
+    Provider,
+    ProviderError,
+    VolumeInfo,
+)
+
+# Transitional states and the state they settle into when waited on
+TRANSITIONS = {
+    PENDING: RUNNING,
+    STOPPING: STOPPED,
+    SHUTTING_DOWN: TERMINATED,
+}
+
+DEFAULT_INSTANCE_TYPES = [
+    InstanceTypeInfo("t3.micro", 2, 1024, ["x86_64"], hibernation=True),
+    InstanceTypeInfo("t3.large", 2, 8192, ["x86_64"], hibernation=True),
+    InstanceTypeInfo("t4g.large", 2, 8192, ["arm64"], hibernation=False),
+    InstanceTypeInfo("m5d.large", 2, 8192, ["x86_64"], 75, hibernation=True),
+]
+
+DEFAULT_IMAGES = [
+    ImageInfo("ami-123", "x86_64", "ubuntu-amd64"),
+    ImageInfo("ami-456", "arm64", "ubuntu-arm64"),
+]
+
+PUBLIC_NETWORK = IPv4Address("198.18.0.0")
+PRIVATE_NETWORK = IPv4Address("10.0.0.0")
+
+
+class InMemoryProvider(Provider):
+    """Simulated provider keeping instances and volumes in process.
+
+    latencies maps an operation name (the method name) to the seconds each
+    call sleeps, so batching can be benchmarked against per-machine calls.
+    The "transition" latency is how long instances stay in a transitional
+    state before describe reports them settled. calls counts the calls made
+    to each operation.
+    """
+
+    instances: dict[str, InstanceInfo]
+    volumes: dict[str, VolumeInfo]
+    instance_types: dict[str, InstanceTypeInfo]
+    images: dict[str, ImageInfo]
+    latencies: dict[str, float]
+    calls: Counter[str]
+
+    def __init__(
+        self,
+        latencies: Optional[dict[str, float]] = None,
+        instance_types: Optional[list[InstanceTypeInfo]] = None,
+        zones: Optional[list[str]] = None,
+        images: Optional[list[ImageInfo]] = None,
+    ) -> None:
+        self.instances = {}
+        self.volumes = {}
+        self.instance_types = {
+            t.name: t for t in (instance_types or DEFAULT_INSTANCE_TYPES)
+        }
+        self.images = {i.id: i for i in (images or DEFAULT_IMAGES)}
+        self.latencies = latencies or {}
+        self.calls = Counter()
+        self._zones = zones or ["local-1a", "local-1b"]
+        self._counter = 0
+        self._changed: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _call(self, operation: str) -> None:
+        with self._lock:
+            self.calls[operation] += 1
+        latency = self.latencies.get(operation, 0.0)
+        if latency:
+            time.sleep(latency)
+
+    def _next(self) -> int:
+        with self._lock:
+            self._counter += 1
+            return self._counter
+
+    def _get(self, ids: list[str]) -> list[InstanceInfo]:
+        missing = [id for id in ids if id not in self.instances]
+        if missing:
+            raise InstanceNotFound(f"Unknown instances {', '.join(missing)}")
+        return [self.instances[id] for id in ids]
+
+    def _set_state(
+        self, ids: list[str], state: str, reason: Optional[str] = None
+    ) -> None:
+        for instance in self._get(ids):
+            instance.state = state
+            instance.reason = reason
+            self._changed[instance.id] = time.monotonic()
+
+    def _settles_at(self, instance: InstanceInfo) -> float:
+        return self._changed.get(instance.id, 0.0) + self.latencies.get(
+            "transition", 0.0
+        )
+
+    def _settle(self, instance: InstanceInfo) -> None:
+        if time.monotonic() >= self._settles_at(instance):
+            instance.state = TRANSITIONS.get(instance.state, instance.state)
+
+    def create(self, spec: InstanceSpec, count: int = 1) -> list[InstanceInfo]:
+        self._call("create")
+        if spec.instance_type not in self.instance_types:
+            raise ProviderError(f"Unknown instance type {spec.instance_type}")
+
+        created = []
+        for _ in range(count):
+            n = self._next()
+            instance = InstanceInfo(
+                id=f"i-{n:017x}",
+                state=PENDING,
+                public_ip_address=str(PUBLIC_NETWORK + n),
+                private_ip_address=str(PRIVATE_NETWORK + n),
+            )
+            with self._lock:
+                self.instances[instance.id] = instance
+                self._changed[instance.id] = time.monotonic()
+            created.append(replace(instance))
+
+        return created
+
+    def describe(self, ids: list[str]) -> list[InstanceInfo]:
+        self._call("describe")
+        with self._lock:
+            instances = [self.instances[id] for id in ids if id in self.instances]
+            for instance in instances:
+                self._settle(instance)
+            return [replace(instance) for instance in instances]
+
+    def start(self, ids: list[str]) -> None:
+        self._call("start")
+        addresses = [str(PUBLIC_NETWORK + self._next()) for _ in ids]
+        with self._lock:
+            self._set_state(ids, PENDING)
+            # Public IPs are released on stop, started instances get a new one
+            for instance, address in zip(self._get(ids), addresses):
+                if not instance.public_ip_address:
+                    instance.public_ip_address = address
+
+    def stop(self, ids: list[str], hibernate: bool = False) -> None:
+        self._call("stop")
+        with self._lock:
+            self._set_state(ids, STOPPING, HIBERNATE_REASON if hibernate else None)
+            for instance in self._get(ids):
+                instance.public_ip_address = None
+
+    def terminate(self, ids: list[str]) -> None:
+        self._call("terminate")
+        with self._lock:
+            self._set_state(ids, SHUTTING_DOWN)
+            for volume in self.volumes.values():
+                if set(volume.attachments) & set(ids):
+                    volume.attachments = []
+                    volume.state = "available"
+
+    def wait(self, ids: list[str], state: str) -> None:
+        self._call("wait")
+        with self._lock:
+            instances = self._get(ids)
+            settles_at = max(
+                [
+                    self._settles_at(instance)
+                    for instance in instances
+                    if TRANSITIONS.get(instance.state) == state
+                ],
+                default=0.0,
+            )
+        # Waiting takes as long as the slowest transition, like describe sees it
+        delay = settles_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+        with self._lock:
+            for instance in instances:
+                self._settle(instance)
+                if instance.state != state:
+                    raise ProviderError(
+                        f"Instance {instance.id} is {instance.state}, expected {state}"
+                    )
+
+    def describe_instance_types(self, types: list[str]) -> list[InstanceTypeInfo]:
+        self._call("describe_instance_types")
+        return [self.instance_types[t] for t in types if t in self.instance_types]
+
+    def describe_images(self, ids: list[str]) -> list[ImageInfo]:
+        self._call("describe_images")
+        return [self.images[id] for id in ids if id in self.images]
+
+    def zones(self) -> list[str]:
+        self._call("zones")
+        return list(self._zones)
+
+    def create_volume(self, disk: Disk, zone: str, tags: dict[str, str]) -> VolumeInfo:
+        self._call("create_volume")
+        volume = VolumeInfo(
+            id=f"vol-{self._next():017x}",
+            zone=zone,
+            size=disk.size,
+            type=disk.type.value.lower(),
+            state="available",
+            tags=dict(tags),
+        )
+        with self._lock:
+            self.volumes[volume.id] = volume
+        return replace(volume)
+
+    def describe_volumes(
+        self,
+        ids: Optional[list[str]] = None,
+        tags: Optional[dict[str, Optional[str]]] = None,
+    ) -> list[VolumeInfo]:
+        self._call("describe_volumes")
+        with self._lock:
+            return [
+                replace(volume, attachments=list(volume.attachments))
+                for volume in self.volumes.values()
+                if (not ids or volume.id in ids)
+                and all(
+                    k in volume.tags and (v is None or volume.tags[k] == v)
+                    for k, v in (tags or {}).items()
+                )
+            ]
+
+    def attach_volume(self, volume_id: str, instance_id: str, device: str) -> None:
+        self._call("attach_volume")
+        with self._lock:
+            self._get([instance_id])
+            volume = self.volumes[volume_id]
+            if volume.attachments:
+                raise ProviderError(f"Volume {volume_id} is already attached")
+            volume.attachments = [instance_id]
+            volume.state = "in-use"
+
+    def delete_volume(self, volume_id: str) -> None:
+        self._call("delete_volume")
+        with self._lock:
+            if self.volumes[volume_id].attachments:
+                raise ProviderError(f"Volume {volume_id} is attached")
+            del self.volumes[volume_id]
+
+    def wait_volumes(self, ids: list[str], state: str) -> None:
+        self._call("wait_volumes")
+        with self._lock:
+            for id in ids:
+                if self.volumes[id].state != state:
+                    raise ProviderError(
+                        f"Volume {id} is {self.volumes[id].state}, expected {state}"
+                    )
@@ -1,29 +1,56 @@
+import shlex
+import socket
+import time
 from dataclasses import dataclass, field
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional
 
 import sh
 
+CONTROL_PATH = "~/.ssh/revel-%C"
+CONTROL_PERSIST = "10m"
+
 
 @dataclass()
 class SSH:
     user: str
     host: str
+    known_hosts: Optional[Path] = None
+    multiplex: bool = False
 
     def __post_init__(self):
-        ssh_keyscan = sh.Command("ssh-keyscan")
-        ssh_keyscan("-4", self.host)
+        keys = scan_host_keys(self.host)
+        if self.known_hosts:
+            pin_host_keys(self.known_hosts, self.host, keys)
+
+    def options(self) -> list[str]:
+        options = []
+        if self.known_hosts:
+            options += [
+                f"-oUserKnownHostsFile={self.known_hosts}",
+                "-oStrictHostKeyChecking=yes",
+            ]
+        if self.multiplex:
+            options += [
+                "-oControlMaster=auto",
+                f"-oControlPath={CONTROL_PATH}",
+                f"-oControlPersist={CONTROL_PERSIST}",
+            ]
+        return options
 
     def run(
         self,
         opts: Optional[list[str]] = field(default_factory=list[str]),
         args: list[str] = field(default_factory=list[str]),
+        foreground: bool = True,
     ) -> sh.Command:
         ssh = sh.Command("ssh")
         command = ssh.bake(
+            *self.options(),
             f"{self.user}@{self.host}",
             *args,
-            _fg=True,
+            **({"_fg": True} if foreground else {}),
         )
         return command
 
@@ -31,15 +58,155 @@ class SSH:
         self,
         src: str,
         dst: str,
-        opts: Optional[list[str]] = field(default_factory=list[str]),
+        opts: Optional[list[str]] = None,
         args: list[str] = field(default_factory=list[str]),
+        foreground: bool = True,
     ) -> sh.Command:
         rsync = sh.Command("rsync")
         full_src = Path(src).expanduser()
         command = rsync.bake(
+            *(["-e", shlex.join(["ssh", *self.options()])] if self.options() else []),
+            *(opts or []),
             full_src,
             f"{self.user}@{self.host}:{dst}",
-            _fg=True,
+            **({"_fg": True} if foreground else {}),
         )
 
         return command
+
+    def pull(
+        self,
+        src: str,
+        dst: str,
+        opts: Optional[list[str]] = None,
+        foreground: bool = True,
+    ) -> sh.Command:
+        rsync = sh.Command("rsync")
+        command = rsync.bake(
+            *(["-e", shlex.join(["ssh", *self.options()])] if self.options() else []),
+            *(opts or []),
+            f"{self.user}@{self.host}:{src}",
+            Path(dst).expanduser(),
+            **({"_fg": True} if foreground else {}),
+        )
+
+        return command
+
+
+@lru_cache(maxsize=None)
+def scan_host_keys(host: str) -> str:
+    """Return the host keys of host, scanned once per process."""
+    ssh_keyscan = sh.Command("ssh-keyscan")
+    return str(ssh_keyscan("-4", host))
+
+
+def wait_for_port(
+    host: str, port: int = 22, poll: float = 0.5, timeout: float = 300.0
+) -> None:
+    """Block until host accepts TCP connections on port."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with socket.create_connection((host, port), timeout=poll):
+                return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Timed out waiting for {host}:{port}")
+            time.sleep(poll)
+
+
+def pin_host_keys(known_hosts: Path, host: str, keys: str) -> bool:
+    """Replace the known_hosts entries of host with keys.
+
+    Returns True if the file was modified.
+    """
+    current = known_hosts.read_text() if known_hosts.exists() else ""
+    lines = [line for line in current.splitlines() if line.split(" ", 1)[0] != host]
+    lines += [
+        line for line in keys.splitlines() if line.strip() and not line.startswith("#")
+    ]
+    content = "".join(f"{line}\n" for line in lines)
+
+    if content == current:
+        return False
+
+    known_hosts.parent.mkdir(parents=True, exist_ok=True)
+    known_hosts.write_text(content)
+    return True
+
+
+def host_config(
+    alias: str,
+    user: str,
+    hostname: str,
+    port: int = 22,
+    multiplex: bool = False,
+    compression: bool = False,
+    known_hosts: Optional[Path] = None,
+) -> str:
+    """Render a ssh_config Host stanza."""
+    options = {
+        "User": user,
+        "Hostname": hostname,
+    }
+    if port != 22:
+        options["Port"] = str(port)
+    if multiplex:
+        options["ControlMaster"] = "auto"
+        options["ControlPath"] = CONTROL_PATH
+        options["ControlPersist"] = CONTROL_PERSIST
+    if compression:
+        options["Compression"] = "yes"
+    if known_hosts:
+        options["UserKnownHostsFile"] = str(known_hosts)
+        options["StrictHostKeyChecking"] = "yes"
+
+    lines = [f"Host {alias}"] + [f"    {k} {v}" for k, v in options.items()]
+    return "\n".join(lines) + "\n"
+
+
+def _split_config(config: str) -> list[tuple[Optional[str], str]]:
+    """Split a ssh_config into (host, block) pairs.
+
+    Anything before the first Host line is returned with a None host.
+    """
+    blocks: list[tuple[Optional[str], str]] = []
+    host: Optional[str] = None
+    lines: list[str] = []
+    for line in config.splitlines(keepends=True):
+        words = line.split()
+        if words and words[0].lower() == "host":
+            if host or "".join(lines).strip():
+                blocks.append((host, "".join(lines)))
+            host = " ".join(words[1:])
+            lines = []
+        lines.append(line)
+    if host or "".join(lines).strip():
+        blocks.append((host, "".join(lines)))
+
+    return blocks
+
+
+def merge_config(
+    existing: str,
+    stanzas: dict[str, str],
+    prune_suffix: Optional[str] = None,
+) -> str:
+    """Merge Host stanzas into an existing ssh_config.
+
+    Stanzas for hosts already present are replaced in place and new ones are
+    appended. When prune_suffix is set, hosts ending with it that are not part
+    of stanzas are dropped.
+    """
+    pending = dict(stanzas)
+    blocks: list[str] = []
+    for host, block in _split_config(existing):
+        if host in pending:
+            blocks.append(pending.pop(host))
+        elif host and prune_suffix and host.endswith(prune_suffix):
+            continue
+        else:
+            blocks.append(block)
+    blocks += pending.values()
+
+    return "\n".join(block.strip("\n") + "\n" for block in blocks)
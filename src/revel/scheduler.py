@@ -0,0 +1,58 @@
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable
+
+from revel.config import InitStep
+
+
+def order(steps: list[InitStep]) -> list[InitStep]:
+    """Sort steps topologically, keeping the declared order between ties."""
+    done: set[str] = set()
+    ordered: list[InitStep] = []
+    pending = list(steps)
+    while pending:
+        ready = [step for step in pending if set(step.needs) <= done]
+        if not ready:
+            ids = ", ".join(step.id for step in pending)
+            raise ValueError(f"Init steps have circular needs: {ids}")
+        for step in ready:
+            pending.remove(step)
+            ordered.append(step)
+            done.add(step.id)
+
+    return ordered
+
+
+def run(
+    steps: list[InitStep],
+    execute: Callable[[InitStep], None],
+    jobs: int = 1,
+) -> None:
+    """Execute steps as soon as their needs are done, jobs at a time.
+
+    No new steps are started after a failure, running ones are waited for and
+    the first error is raised.
+    """
+    pending = order(steps)
+    done: set[str] = set()
+    running: dict[Future[None], InitStep] = {}
+    error = None
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while pending or running:
+            if error is None:
+                for step in [s for s in pending if set(s.needs) <= done]:
+                    if len(running) >= jobs:
+                        break
+                    pending.remove(step)
+                    running[executor.submit(execute, step)] = step
+            elif not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                step = running.pop(future)
+                if future.exception() and error is None:
+                    error = future.exception()
+                done.add(step.id)
+
+    if error:
+        raise error
@@ -0,0 +1,150 @@
+"""Sharded uploads of large directory trees.
+
+A single rsync stream is bound by one core and the connection latency, so
+large trees are split into shards of similar size and file count, each one
+uploaded by its own rsync process over the multiplexed SSH connection.
+"""
+
+import heapq
+import os
+import posixpath
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Optional
+
+from sh import ErrorReturnCode
+
+from revel.providers.ssh import SSH
+
+# Bytes a file weighs on top of its size, accounting for the per file
+# overhead of rsync so shards of many small files are not overloaded.
+FILE_COST = 64 * 1024
+
+
+@dataclass
+class Shard:
+    files: list[str] = field(default_factory=list[str])
+    size: int = 0
+    weight: int = 0
+
+
+def scan(root: Path) -> list[tuple[str, int]]:
+    """List the files under root as (relative path, size) pairs.
+
+    Empty directories are listed too so they are created on the remote, as
+    are symlinks to directories, which rsync copies as links.
+    """
+    files = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        path = Path(dirpath)
+        if not dirnames and not filenames and path != root:
+            files.append((str(path.relative_to(root)), 0))
+        for dirname in dirnames:
+            link = path / dirname
+            if link.is_symlink():
+                files.append((str(link.relative_to(root)), link.lstat().st_size))
+        for filename in filenames:
+            file = path / filename
+            files.append((str(file.relative_to(root)), file.lstat().st_size))
+
+    return files
+
+
+def total_size(path: Path) -> int:
+    """Return the size of a file or the total size of the files of a tree."""
+    if path.is_dir():
+        return sum(file_size for _, file_size in scan(path))
+    return path.stat().st_size if path.exists() else 0
+
+
+def split(
+    files: list[tuple[str, int]], count: int, file_cost: int = FILE_COST
+) -> list[Shard]:
+    """Split files in up to count shards of balanced weight.
+
+    Files are assigned from the largest to the lightest shard so far, which
+    keeps the heaviest shard close to the optimum.
+    """
+    shards = [Shard() for _ in range(max(1, min(count, len(files))))]
+    heap = [(0, index) for index in range(len(shards))]
+    for name, size in sorted(files, key=lambda file: file[1], reverse=True):
+        weight, index = heapq.heappop(heap)
+        shard = shards[index]
+        shard.files.append(name)
+        shard.size += size
+        shard.weight = weight + size + file_cost
+        heapq.heappush(heap, (shard.weight, index))
+
+    return [shard for shard in shards if shard.files]
+
+
+def upload(
+    client: SSH,
+    src: str,
+    dst: str,
+    shards: list[Shard],
+    opts: Optional[list[str]] = None,
+    progress: Optional[Callable[[int], None]] = None,
+) -> int:
+    """Upload the shards of src to dst in parallel.
+
+    Like a plain rsync of src without a trailing slash, the tree ends up in
+    dst/<name of src>, so sharding an entry does not move its files.
+    progress is called with the bytes done as files are transferred, files
+    already up to date count when their shard finishes. Returns the exit
+    status of the first failed shard, 0 if all succeeded.
+    """
+    target = posixpath.join(dst, Path(src).expanduser().name)
+    lock = threading.Lock()
+
+    def advance(size: int) -> None:
+        if progress and size > 0:
+            with lock:
+                progress(size)
+
+    def run(shard: Shard) -> int:
+        transferred = 0
+
+        def on_line(line: str) -> None:
+            nonlocal transferred
+            try:
+                size = int(line.strip())
+            except ValueError:
+                return
+            size = min(size, shard.size - transferred)
+            transferred += size
+            advance(size)
+
+        with tempfile.NamedTemporaryFile("w") as files_from:
+            files_from.write("\0".join(shard.files))
+            files_from.flush()
+            command = client.sync(
+                src=src,
+                dst=target,
+                opts=[
+                    "--archive",
+                    f"--files-from={files_from.name}",
+                    "--from0",
+                    "--out-format=%l",
+                    *(opts or []),
+                ],
+                foreground=False,
+            )
+            try:
+                command(_out=on_line)
+            except ErrorReturnCode as e:
+                return e.exit_code
+
+        advance(shard.size - transferred)
+        return 0
+
+    # Open the shared connection and create target before the streams race for it
+    client.run(args=["mkdir", "-p", target], foreground=False)()
+
+    with ThreadPoolExecutor(max_workers=len(shards) or 1) as executor:
+        statuses = list(executor.map(run, shards))
+
+    return next((status for status in statuses if status), 0)
@@ -1,11 +1,19 @@
 from pathlib import Path
+from typing import Any
 
 import typer
 
 from revel import __name__ as cli_name
 
-state = {
+state: dict[str, Any] = {
     "config": Path("./revel.yml"),
     "state": Path(f"{typer.get_app_dir(cli_name)}/state"),
+    "known_hosts": Path(f"{typer.get_app_dir(cli_name)}/known_hosts"),
     "debug": False,
+    "workers": 4,
+    "api_rate": None,
+    # Reuse SSH connections between commands, set while running a batch
+    "multiplex": False,
+    # Set while running a batch, batches can not be nested
+    "batch": False,
 }
@@ -0,0 +1,209 @@
+"""Captured output of provision runs.
+
+The output of each init step is streamed by the reader threads of sh into a
+log file per machine and step, bounded to MAX_BYTES plus one rotated file.
+The terminal is only updated by a StatusBoard thread that redraws a status
+line per step, so slow terminals never hold back the steps.
+"""
+
+import json
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+import typer
+
+LOGS_DIR = "logs"
+RUN_FILE = "run.json"
+MAX_BYTES = 1024 * 1024
+TAIL_LINES = 20
+
+RUNNING = "running"
+OK = "ok"
+FAILED = "failed"
+
+
+def log_dir(state_dir: Path, machine: str) -> Path:
+    return state_dir / LOGS_DIR / machine
+
+
+def step_path(state_dir: Path, machine: str, step: str) -> Path:
+    return log_dir(state_dir, machine) / f"{step}.log"
+
+
+def _rotated(path: Path) -> Path:
+    return path.with_name(f"{path.name}.1")
+
+
+def read(path: Path) -> str:
+    """Return the content of a step log, including its rotated part."""
+    return "".join(p.read_text() for p in [_rotated(path), path] if p.exists())
+
+
+def tail(path: Path, lines: int = TAIL_LINES) -> list[str]:
+    return read(path).splitlines()[-lines:]
+
+
+def read_run(state_dir: Path, machine: str) -> dict[str, dict[str, Any]]:
+    """Return the steps of the last run of machine by ID."""
+    try:
+        return json.loads((log_dir(state_dir, machine) / RUN_FILE).read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+class StepLog:
+    def __init__(self, path: Path, max_bytes: int = MAX_BYTES) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.status = RUNNING
+        self.exit_code: Optional[int] = None
+        self.started = time.time()
+        self.finished: Optional[float] = None
+        self.last_line = ""
+        self._size = 0
+        self._file = path.open("w")
+        self._lock = threading.Lock()
+
+    @property
+    def duration(self) -> float:
+        return (self.finished or time.time()) - self.started
+
+    def write(self, data: str) -> None:
+        with self._lock:
+            if self._file.closed:
+                return
+            if self._size + len(data) > self.max_bytes:
+                self._file.close()
+                self.path.replace(_rotated(self.path))
+                self._file = self.path.open("w")
+                self._size = 0
+            self._file.write(data)
+            self._size += len(data)
+            if data.strip():
+                self.last_line = data.strip().splitlines()[-1]
+
+    def close(self, exit_code: int) -> None:
+        with self._lock:
+            self._file.close()
+            self.exit_code = exit_code
+            self.status = FAILED if exit_code else OK
+            self.finished = time.time()
+
+
+class RunLog:
+    """Logs of a provision run, replacing the ones of the previous run."""
+
+    def __init__(self, state_dir: Path, machine: str, max_bytes: int = MAX_BYTES):
+        self.dir = log_dir(state_dir, machine)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        for path in self.dir.glob("*.log*"):
+            path.unlink()
+        self.max_bytes = max_bytes
+        self.steps: dict[str, StepLog] = {}
+        self._lock = threading.Lock()
+        self.save()
+
+    @contextmanager
+    def step(self, id: str) -> Iterator[StepLog]:
+        log = StepLog(self.dir / f"{id}.log", self.max_bytes)
+        with self._lock:
+            self.steps[id] = log
+        self.save()
+        try:
+            yield log
+        except BaseException as e:
+            log.close(getattr(e, "exit_code", None) or 1)
+            raise e
+        else:
+            log.close(0)
+        finally:
+            self.save()
+
+    def snapshot(self) -> list[tuple[str, StepLog]]:
+        with self._lock:
+            return list(self.steps.items())
+
+    def failed(self) -> list[StepLog]:
+        with self._lock:
+            return [log for log in self.steps.values() if log.status == FAILED]
+
+    def save(self) -> None:
+        with self._lock:
+            run = {
+                id: {
+                    "status": log.status,
+                    "exit_code": log.exit_code,
+                    "started": log.started,
+                    "duration": round(log.duration, 1),
+                }
+                for id, log in self.steps.items()
+            }
+            tmp_path = self.dir / f"{RUN_FILE}.tmp"
+            tmp_path.write_text(json.dumps(run))
+            tmp_path.replace(self.dir / RUN_FILE)
+
+
+class StatusBoard:
+    """Show a status line per step of a run, redrawn by a background thread.
+
+    Terminals get the lines redrawn in place, other outputs only get a line
+    when a step starts or finishes.
+    """
+
+    SYMBOLS = {RUNNING: "-", OK: "✔", FAILED: "✖"}
+
+    def __init__(
+        self, run_log: RunLog, interval: float = 0.2, live: Optional[bool] = None
+    ) -> None:
+        self.run_log = run_log
+        self.interval = interval
+        self.live = (
+            live if live is not None else typer.get_text_stream("stdout").isatty()
+        )
+        self._drawn = 0
+        self._reported: dict[str, str] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+
+    def __enter__(self) -> "StatusBoard":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.render()
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.render()
+
+    def _line(self, id: str, log: StepLog, width: int) -> str:
+        line = f"{self.SYMBOLS[log.status]} {id} {log.status} {log.duration:.1f}s"
+        if log.status == FAILED:
+            line += f" (exit code {log.exit_code})"
+        elif log.status == RUNNING and log.last_line:
+            line += f" | {log.last_line}"
+        return line[:width]
+
+    def render(self) -> None:
+        steps = self.run_log.snapshot()
+        width = shutil.get_terminal_size().columns - 1
+        if self.live:
+            # Move back to the first line drawn and redraw all of them
+            output = f"\x1b[{self._drawn}F" if self._drawn else ""
+            output += "".join(
+                f"\x1b[2K{self._line(id, log, width)}\n" for id, log in steps
+            )
+            typer.echo(output, nl=False)
+            self._drawn = len(steps)
+            return
+
+        for id, log in steps:
+            if self._reported.get(id) != log.status:
+                self._reported[id] = log.status
+                typer.echo(self._line(id, log, width))
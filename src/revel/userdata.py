@@ -0,0 +1,94 @@
+from shlex import quote
+from typing import Optional
+
+PER_BOOT_SCRIPT = "/var/lib/cloud/scripts/per-boot/revel-disks.sh"
+
+FUNCTIONS = r"""
+resolve_device() {
+  # EBS volumes show up as NVMe devices on Nitro instances, the requested
+  # device name is stored in the vendor specific area of the controller.
+  local name="${1#/dev/}"
+  for candidate in "/dev/${name}" "/dev/xvd${name#sd}"; do
+    if [ -b "${candidate}" ]; then echo "${candidate}"; return 0; fi
+  done
+  for nvme in /dev/nvme*n1; do
+    [ -b "${nvme}" ] || continue
+    local mapped
+    mapped=$(nvme id-ctrl --raw-binary "${nvme}" 2>/dev/null | cut -c3073-3104 | tr -d ' \0')
+    if [ "${mapped#/dev/}" = "${name}" ]; then echo "${nvme}"; return 0; fi
+  done
+  return 1
+}
+
+mount_volume() {
+  local device="" mount="$2" owner="$3"
+  for _ in $(seq 1 60); do
+    device=$(resolve_device "$1") && break
+    sleep 5
+  done
+  if [ -z "${device}" ]; then echo "revel: unable to find $1" >&2; return 1; fi
+  if ! blkid "${device}" >/dev/null; then
+    mkfs.ext4 -q "${device}"
+    mkdir -p "${mount}" && mount "${device}" "${mount}" && chown "${owner}": "${mount}"
+  fi
+  local uuid
+  uuid=$(blkid -s UUID -o value "${device}")
+  grep -q "UUID=${uuid}" /etc/fstab || echo "UUID=${uuid} ${mount} ext4 defaults,nofail 0 2" >> /etc/fstab
+  mkdir -p "${mount}"
+  mountpoint -q "${mount}" || mount "${mount}"
+}
+
+mount_scratch() {
+  # Instance store is wiped on every stop, so it is formatted on every boot.
+  local mount="$1" device
+  local disks=(/dev/disk/by-id/nvme-Amazon_EC2_NVMe_Instance_Storage_*)
+  [ -e "${disks[0]}" ] || return 0
+  device="${disks[0]}"
+  if [ "${#disks[@]}" -gt 1 ] && command -v mdadm >/dev/null; then
+    mdadm --create /dev/md/revel-scratch --run --level=0 --raid-devices="${#disks[@]}" "${disks[@]}"
+    device=/dev/md/revel-scratch
+  fi
+  mountpoint -q "${mount}" && return 0
+  mkfs.ext4 -q -F "${device}"
+  mkdir -p "${mount}"
+  mount -o discard,noatime "${device}" "${mount}"
+  chmod 1777 "${mount}"
+}
+"""
+
+
+def user_data(
+    user: Optional[str],
+    volumes: list[tuple[str, str]],
+    scratch: Optional[str] = None,
+) -> Optional[str]:
+    """Build a user data script formatting and mounting the machine disks.
+
+    volumes is a list of (device, mount) pairs for EBS data volumes, which get
+    formatted on first use. scratch is the mount point for the NVMe instance
+    store, if any. The script is installed as a cloud-init per-boot script so
+    mounts are restored after a stop/start.
+    """
+    owner = quote(user or "root")
+    steps = [
+        f"mount_volume {quote(device)} {quote(mount)} {owner}"
+        for device, mount in volumes
+    ]
+    if scratch:
+        steps.append(f"mount_scratch {quote(scratch)}")
+    if not steps:
+        return None
+
+    script = "\n".join(["#!/bin/bash", FUNCTIONS.strip(), "", *steps])
+    return "\n".join(
+        [
+            "#!/bin/bash",
+            f"mkdir -p {quote(PER_BOOT_SCRIPT.rsplit('/', 1)[0])}",
+            f"cat > {PER_BOOT_SCRIPT} <<'REVEL'",
+            script,
+            "REVEL",
+            f"chmod +x {PER_BOOT_SCRIPT}",
+            f"exec {PER_BOOT_SCRIPT}",
+            "",
+        ]
+    )
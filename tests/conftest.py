@@ -1,8 +1,9 @@
+import os
 from pathlib import Path
 
 import pytest
 
-import revel
+import revel.state
 
 
 @pytest.fixture(autouse=True)
@@ -28,3 +29,24 @@ def mock_state_conf(monkeypatch, tmp_path):
             "state": tmp_path,
         },
     )
+
+
+@pytest.fixture
+def fake_commands(monkeypatch, tmp_path):
+    """Put ssh and rsync stand-ins first in PATH.
+
+    They print their arguments, one per line, and append them to calls.log
+    for tests to assert on. FAKE_STATUS sets their exit status.
+    """
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    for name in ["ssh", "rsync"]:
+        command = bin_dir / name
+        command.write_text(
+            "#!/bin/sh\n"
+            'printf "%s\\n" "$(basename "$0")" "$@" | tee -a "$(dirname "$0")/calls.log"\n'
+            'exit "${FAKE_STATUS:-0}"\n'
+        )
+        command.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    return bin_dir
@@ -0,0 +1,77 @@
+from revel.providers.aws import RateLimiter, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+def test_token_bucket_waits_when_empty():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2.0, capacity=2.0, clock=clock, sleep=clock.sleep)
+
+    assert bucket.acquire() == 0.0
+    assert bucket.acquire() == 0.0
+    assert bucket.acquire() == 0.5, "Third token should wait for a refill"
+
+    clock.now += 10
+    assert bucket.acquire() == 0.0
+    assert bucket.tokens == 1.0, "Bucket should not refill above capacity"
+
+
+def test_rate_limiter_buckets_per_action():
+    limiter = RateLimiter()
+
+    limiter.acquire("DescribeInstances")
+    limiter.acquire("RunInstances")
+
+    assert limiter.buckets["DescribeInstances"].rate == 10.0
+    assert limiter.buckets["RunInstances"].rate == 2.0
+    assert limiter.calls == 2
+    assert limiter.report() is None
+
+
+def test_rate_limiter_measures_retry_backoff():
+    clock = FakeClock()
+    limiter = RateLimiter(clock=clock)
+    throttled = (None, {"Error": {"Code": "RequestLimitExceeded"}})
+
+    limiter._needs_retry(response=throttled)
+    clock.now += 1.5
+    limiter._before_send()
+    # Sends that do not follow a throttled response are not counted
+    clock.now += 10
+    limiter._before_send()
+
+    assert limiter.retries == 1
+    assert limiter.backoff == 1.5
+    assert limiter.throttled == 1.5
+    assert "1.5s backing off" in limiter.report()
+
+
+def test_rate_limiter_below_one_request_per_burst():
+    limiter = RateLimiter(rate=0.4)
+    limiter.acquire("DescribeInstances")
+
+    assert limiter.buckets["DescribeInstances"].capacity == 1.0
+
+
+def test_rate_limiter_forgets_backoff_of_final_attempt():
+    clock = FakeClock()
+    limiter = RateLimiter(clock=clock)
+    throttled = (None, {"Error": {"Code": "RequestLimitExceeded"}})
+
+    # Attempts are exhausted, the call fails without another send
+    limiter._needs_retry(response=throttled)
+    limiter._after_call()
+    clock.now += 30
+    limiter._before_send()
+
+    assert limiter.retries == 1
+    assert limiter.backoff == 0.0
@@ -0,0 +1,28 @@
+import pytest
+
+from revel import batch
+
+
+def test_parse_script_and_json_lines():
+    commands = batch.parse("""
+        # Setup
+        create default
+        provision default --jobs 4
+        ["sync", "default"]
+        {"args": ["ssh-config", "--all"]}
+        exec default -- 'echo done'
+        """)
+
+    assert commands == [
+        ["create", "default"],
+        ["provision", "default", "--jobs", "4"],
+        ["sync", "default"],
+        ["ssh-config", "--all"],
+        ["exec", "default", "--", "echo done"],
+    ]
+
+
+@pytest.mark.parametrize("line", ['{"args": []}', "[1, ", "ssh 'default"])
+def test_parse_errors_report_line(line):
+    with pytest.raises(ValueError, match="Line 2"):
+        batch.parse(f"list\n{line}\n")
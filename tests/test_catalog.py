@@ -0,0 +1,53 @@
+import boto3
+import pytest
+from moto import mock_ec2
+
+from revel.catalog import Catalog
+from revel.providers.ec2 import EC2Provider
+from revel.providers.memory import InMemoryProvider
+
+
+def test_catalog_refreshes_only_missing_and_expired(tmp_path):
+    provider = InMemoryProvider()
+    now = [0.0]
+    catalog = Catalog(tmp_path, provider, ttl=60, clock=lambda: now[0])
+
+    assert catalog.instance_types(["t3.micro"])["t3.micro"].memory == 1024
+    catalog.instance_types(["t3.micro", "t3.large"])
+    assert provider.calls["describe_instance_types"] == 2
+
+    # A new catalogue reads the entries stored by the previous one
+    catalog = Catalog(tmp_path, provider, ttl=60, clock=lambda: now[0])
+    catalog.validate("t3.large", "ami-123", hibernate=True)
+    assert provider.calls["describe_instance_types"] == 2
+    assert provider.calls["describe_images"] == 1
+
+    now[0] = 120
+    catalog.instance_types(["t3.large"])
+    assert provider.calls["describe_instance_types"] == 3
+
+
+@pytest.mark.parametrize(
+    "instance_type,image,hibernate,error",
+    [
+        ("t3.nano", "ami-123", False, "Unknown instance type t3.nano"),
+        ("t3.micro", "ami-000", False, "Unknown image ami-000"),
+        ("t4g.large", "ami-123", False, "Image ami-123 is x86_64"),
+        ("t4g.large", "ami-456", True, "does not support hibernation"),
+    ],
+)
+def test_catalog_validate(tmp_path, instance_type, image, hibernate, error):
+    catalog = Catalog(tmp_path, InMemoryProvider())
+
+    with pytest.raises(ValueError, match=error):
+        catalog.validate(instance_type, image, hibernate=hibernate)
+
+
+@mock_ec2()
+def test_ec2_leaves_out_unknown_instance_types():
+    provider = EC2Provider(boto3.client("ec2"))
+
+    instance_types = provider.describe_instance_types(["t3.micro", "t3.typo"])
+
+    assert [t.name for t in instance_types] == ["t3.micro"]
+    assert instance_types[0].architectures == ["x86_64"]
@@ -1,9 +1,13 @@
-# import pytest
+import pytest
+
 # from pytest_mock import MockerFixture
 from typer.testing import CliRunner
 
 # from revel import MachineManager,
-from revel import cli
+from revel import MachineManager, cli, metrics, state, steplog
+from revel.machine import MachineState
+from revel.providers import ssh
+from revel.providers.memory import InMemoryProvider
 
 # from revel.machine import Machine
 
@@ -69,3 +73,235 @@ def test_shows_help():
 #         assert mm.get.called
 
 #     assert result.exit_code == 0, result.output
+
+
+def test_api_rate_must_be_positive():
+    result = runner.invoke(app=cli.app, args=["--api-rate", "0", "logs", "default"])
+
+    assert result.exit_code == 2, result.output
+
+
+def test_invalid_config_fails_before_provisioning(tmp_path, monkeypatch):
+    monkeypatch.setitem(state.state, "state", tmp_path)
+    with steplog.RunLog(tmp_path, "default").step("update") as log:
+        log.write("Reading package lists...\n")
+    config = tmp_path / "revel.yml"
+    config.write_text(
+        "default:\n"
+        "  ami: ami-123\n"
+        "  user: ubuntu\n"
+        "  init:\n"
+        "    - {id: a, run: 'true', needs: b}\n"
+        "    - {id: b, run: 'true', needs: a}\n"
+    )
+
+    result = runner.invoke(app=cli.app, args=["--config", str(config), "provision"])
+
+    assert result.exit_code == 1, result.output
+    assert "circular needs" in result.output
+    # The logs of the previous run are kept
+    assert list(steplog.read_run(tmp_path, "default")) == ["update"]
+    assert steplog.step_path(tmp_path, "default", "update").exists()
+
+
+def test_batch_reports_each_command(tmp_path):
+    commands = tmp_path / "commands"
+    commands.write_text('--version\n["--help"]\n')
+
+    result = runner.invoke(app=cli.app, args=["batch", str(commands)])
+
+    assert result.exit_code == 0, result.output
+    assert "$ revel --version" in result.output
+    assert "$ revel --help" in result.output
+
+
+def test_batch_stops_on_error(tmp_path):
+    result = runner.invoke(
+        app=cli.app, args=["batch", "-"], input="unknown-command\n--version\n"
+    )
+
+    assert result.exit_code == 2, result.output
+    assert "Skipped 1 commands" in result.output
+
+
+def test_batch_can_not_be_nested(tmp_path):
+    inner = tmp_path / "inner"
+    inner.write_text("--version\n")
+    commands = tmp_path / "commands"
+    commands.write_text(f"--debug batch {inner}\n")
+
+    result = runner.invoke(app=cli.app, args=["batch", str(commands)])
+
+    assert result.exit_code == 1, result.output
+    assert "Batches can not be nested" in result.output
+    assert "$ revel --version" not in result.output
+
+
+def test_commands_are_recorded_in_metrics(tmp_path, monkeypatch):
+    monkeypatch.setitem(state.state, "state", tmp_path)
+    result = runner.invoke(
+        app=cli.app,
+        args=["--config", "tests/mock/full_config.yml", "sync", "missing"],
+    )
+
+    assert result.exit_code == 0, result.output
+    records = metrics.read(tmp_path)
+    assert [(r.operation, r.machine, r.outcome) for r in records] == [
+        ("sync", "missing", metrics.SKIPPED)
+    ]
+
+    metrics.append(tmp_path, metrics.Record("create", "default", 0, duration=5.0))
+    textfile = tmp_path / "revel.prom"
+    result = runner.invoke(app=cli.app, args=["metrics", "--textfile", str(textfile)])
+
+    assert result.exit_code == 0, result.output
+    assert "create" in result.output
+    # Skipped runs are kept in the log but left out of the aggregates
+    assert not [line for line in result.output.splitlines() if line.startswith("sync")]
+    assert 'revel_operations{operation="create"} 1' in textfile.read_text()
+
+
+def test_logs_show_last_run(tmp_path, monkeypatch):
+    monkeypatch.setitem(state.state, "state", tmp_path)
+    run_log = steplog.RunLog(tmp_path, "default")
+    with run_log.step("update") as log:
+        log.write("Reading package lists...\n")
+
+    result = runner.invoke(app=cli.app, args=["logs", "default"])
+    assert result.exit_code == 0, result.output
+    assert "update" in result.output
+
+    result = runner.invoke(app=cli.app, args=["logs", "default", "update"])
+    assert result.output == "Reading package lists...\n"
+
+
+def test_connect_wakes_machine_stopped_on_the_box(tmp_path, monkeypatch):
+    monkeypatch.setattr(cli, "wait_for_port", lambda *args: None)
+    monkeypatch.setattr(cli, "SSH", lambda user, host, **kwargs: (user, host))
+    provider = InMemoryProvider()
+    mm = MachineManager(tmp_path, "default", provider)
+    mm.create(ami="ami-123", key_name="key")
+    ip = mm.machine.public_ip_address
+
+    # Auto shutdown on the box, the local state still says running
+    provider.stop([mm.machine.id])
+    provider.wait([mm.machine.id], "stopped")
+    assert mm.machine.state == MachineState.RUNNING
+
+    user, host = cli.connect(mm, wake=True, known_hosts=tmp_path / "known_hosts")
+
+    assert provider.calls["start"] == 1
+    assert mm.machine.state == MachineState.RUNNING
+    assert host == mm.machine.public_ip_address
+    assert host != ip
+
+
+def test_connect_wakes_machine_still_stopping(tmp_path, monkeypatch):
+    monkeypatch.setattr(cli, "wait_for_port", lambda *args: None)
+    monkeypatch.setattr(cli, "SSH", lambda user, host, **kwargs: (user, host))
+    provider = InMemoryProvider()
+    mm = MachineManager(tmp_path, "default", provider)
+    mm.create(ami="ami-123", key_name="key")
+
+    # Auto shutdown still in progress on the box
+    provider.latencies["transition"] = 0.1
+    provider.stop([mm.machine.id])
+    assert provider.describe([mm.machine.id])[0].state == "stopping"
+
+    user, host = cli.connect(mm, wake=True, known_hosts=tmp_path / "known_hosts")
+
+    assert provider.calls["start"] == 1
+    assert mm.machine.state == MachineState.RUNNING
+    assert host == mm.machine.public_ip_address
+
+
+def pull_fleet(tmp_path, monkeypatch):
+    provider = InMemoryProvider()
+    monkeypatch.setattr(cli, "get_provider", lambda: provider)
+    monkeypatch.setattr(ssh, "scan_host_keys", lambda host: "")
+    monkeypatch.setitem(state.state, "state", tmp_path / "state")
+    monkeypatch.setitem(state.state, "known_hosts", tmp_path / "known_hosts")
+    for name in ["alpha", "beta"]:
+        MachineManager(tmp_path / "state", name, provider).create(
+            ami="ami-123", key_name="key"
+        )
+    # Saved but never created, it has no instance id
+    MachineManager(tmp_path / "state", "pending", provider).save()
+
+    config = tmp_path / "revel.yml"
+    config.write_text(
+        "bench:\n"
+        "  ami: ami-123\n"
+        "  user: ubuntu\n"
+        f"  pull:\n    - /var/log/bench:{tmp_path / 'out'}\n"
+    )
+    return config
+
+
+def test_pull_all_gathers_into_machine_dirs(tmp_path, monkeypatch, fake_commands):
+    config = pull_fleet(tmp_path, monkeypatch)
+
+    result = runner.invoke(
+        app=cli.app, args=["--config", str(config), "pull", "bench", "--all"]
+    )
+
+    assert result.exit_code == 0, result.output
+    assert "Skipping pending, it does not exist" in result.output
+    calls = (fake_commands / "calls.log").read_text()
+    for name in ["alpha", "beta"]:
+        assert (tmp_path / "out" / name).is_dir()
+        assert f"{tmp_path / 'out' / name}\n" in calls
+    assert "--archive\n--compress\n--stats\n" in calls
+
+
+def test_pull_exits_with_rsync_status(tmp_path, monkeypatch, fake_commands):
+    config = pull_fleet(tmp_path, monkeypatch)
+    monkeypatch.setenv("FAKE_STATUS", "23")
+
+    result = runner.invoke(
+        app=cli.app, args=["--config", str(config), "pull", "bench", "--all"]
+    )
+
+    assert result.exit_code == 23, result.output
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ["refresh", "--all"],
+        ["stop", "--all"],
+        ["metrics", "--textfile", "m", "--refresh"],
+    ],
+)
+def test_fleet_commands_skip_machines_without_instances(tmp_path, monkeypatch, args):
+    provider = InMemoryProvider()
+    monkeypatch.setattr(cli, "get_provider", lambda: provider)
+    monkeypatch.setitem(state.state, "state", tmp_path)
+    monkeypatch.chdir(tmp_path)
+    MachineManager(tmp_path, "alpha", provider).create(ami="ami-123", key_name="key")
+    MachineManager(tmp_path, "failed", provider).save()
+
+    result = runner.invoke(app=cli.app, args=args)
+
+    assert result.exit_code == 0, result.output
+
+
+def test_sync_copies_directories_whole(tmp_path, monkeypatch, fake_commands):
+    monkeypatch.setattr(ssh, "scan_host_keys", lambda host: "")
+    monkeypatch.setattr(cli, "get_provider", InMemoryProvider)
+    monkeypatch.setattr(cli, "connect", lambda *args, **kwargs: ssh.SSH("u", "h"))
+    monkeypatch.setitem(state.state, "state", tmp_path)
+    (tmp_path / "code").mkdir()
+    config = tmp_path / "revel.yml"
+    config.write_text(
+        "default:\n"
+        "  ami: ami-123\n"
+        "  user: ubuntu\n"
+        f"  sync:\n    - {tmp_path / 'code'}:/home/ubuntu\n"
+    )
+
+    result = runner.invoke(app=cli.app, args=["--config", str(config), "sync"])
+
+    assert result.exit_code == 0, result.output
+    calls = (fake_commands / "calls.log").read_text().splitlines()
+    assert calls == ["rsync", "--archive", str(tmp_path / "code"), "u@h:/home/ubuntu"]
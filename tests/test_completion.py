@@ -0,0 +1,44 @@
+import subprocess
+import sys
+
+from revel import MachineManager, completion
+from revel.providers.memory import InMemoryProvider
+
+
+def test_machine_names_follow_state(tmp_path):
+    provider = InMemoryProvider()
+    mm = MachineManager(tmp_path, "beta", provider)
+    mm.create(ami="ami-123", key_name="key")
+    MachineManager(tmp_path, "alpha", provider).create(ami="ami-123", key_name="key")
+
+    assert completion.machine_names(tmp_path) == ["alpha", "beta"]
+    assert completion.complete(completion.machine_names(tmp_path), "b") == ["beta"]
+
+    mm.destroy()
+    assert completion.machine_names(tmp_path) == ["alpha"]
+
+
+def test_machine_names_include_concurrent_creates(tmp_path):
+    provider = InMemoryProvider()
+    MachineManager(tmp_path, "alpha", provider).create(ami="ami-123", key_name="key")
+    assert completion.machine_names(tmp_path) == ["alpha"]
+
+    # Saved by another process behind the back of this one
+    (tmp_path / "beta.yml").write_text("name: beta\n")
+    assert completion.machine_names(tmp_path) == ["alpha", "beta"]
+
+
+def test_instance_index_follows_config(tmp_path):
+    config = tmp_path / "revel.yml"
+    config.write_text("default:\n  ami: ami-123\n  user: ubuntu\n")
+    state_dir = tmp_path / "state"
+
+    assert completion.instance_names(state_dir, config) == ["default"]
+
+    config.write_text("default: {}\nother: {}\n")
+    assert completion.instance_names(state_dir, config) == ["default", "other"]
+
+
+def test_cli_import_skips_aws():
+    code = "import sys, revel.cli; assert 'boto3' not in sys.modules"
+    subprocess.run([sys.executable, "-c", code], check=True)
@@ -1,5 +1,7 @@
 from pathlib import Path
 
+import pytest
+
 from revel import config
 
 
@@ -14,3 +16,89 @@ def test_full_config_load():
         assert isinstance(
             v, config.Instance
         ), f"Instances {k} should be of type Instance"
+
+
+def test_disk_config_load():
+    result = config.Instance.parse(
+        ami="ami-123",
+        user="ubuntu",
+        disk={"size": 50, "type": "gp3", "iops": 6000, "throughput": 500},
+        volumes=[{"size": 100, "type": "IO2", "iops": 8000, "mount": "/data"}],
+    )
+
+    assert result.disk == config.Disk(
+        type=config.DiskType.GP3, size=50, iops=6000, throughput=500
+    )
+    assert result.volumes[0].type == config.DiskType.IO2
+    assert result.volumes[0].mount == "/data"
+    assert result.scratch == "/scratch", "Instance store should mount by default"
+
+
+def test_init_steps_load():
+    steps = config.InitStep.parse_steps(
+        [
+            {"run": "apt-get update"},
+            {"parallel": [{"id": "rust", "run": "rustup"}, {"run": "git clone"}]},
+            {"files": ["~/.yarnrc:/tmp/.yarnrc"]},
+            {"id": "images", "run": "docker pull", "needs": ["step-1"]},
+        ]
+    )
+
+    needs = {step.id: step.needs for step in steps}
+    assert needs == {
+        "step-1": [],
+        "rust": ["step-1"],
+        "step-2.2": ["step-1"],
+        "step-3": ["rust", "step-2.2"],
+        "images": ["step-1"],
+    }
+    assert isinstance(steps[3].action, config.SyncFiles)
+
+
+def test_init_step_needs_accept_a_string():
+    steps = config.InitStep.parse_steps(
+        [
+            {"id": "update", "run": "apt-get update"},
+            {"id": "tools", "run": "apt-get install"},
+            {"parallel": [{"run": "rustup", "needs": "tools"}], "needs": "update"},
+            {"id": "images", "run": "docker pull", "needs": "update"},
+        ]
+    )
+
+    needs = {step.id: step.needs for step in steps}
+    assert needs["step-3.1"] == ["tools"]
+    assert needs["images"] == ["update"]
+
+
+@pytest.mark.parametrize("id", ["build/x", "../x", ".hidden", ""])
+def test_init_step_ids_must_be_file_names(id):
+    with pytest.raises(ValueError, match="Invalid init step id"):
+        config.InitStep.parse_steps([{"id": id, "run": "make"}])
+
+
+def test_init_step_cycles_fail_to_load():
+    with pytest.raises(ValueError, match="circular needs"):
+        config.InitStep.parse_steps(
+            [
+                {"id": "a", "run": "true", "needs": "b"},
+                {"id": "b", "run": "true", "needs": "a"},
+            ]
+        )
+
+
+def test_sync_entries_load():
+    result = config.Instance.parse(
+        ami="ami-123",
+        user="ubuntu",
+        sync=[
+            "~/.yarnrc:/tmp/.yarnrc",
+            {"src": "~/code", "dst": "/home/ubuntu/code", "shards": 8, "compress": 3},
+        ],
+        pull=["/home/ubuntu/results:./results"],
+    )
+
+    assert result.sync == [
+        config.SyncEntry("~/.yarnrc", "/tmp/.yarnrc"),
+        config.SyncEntry("~/code", "/home/ubuntu/code", shards=8, compress=3),
+    ]
+    assert result.pull == [config.SyncEntry("/home/ubuntu/results", "./results")]
@@ -5,6 +5,11 @@ import pytest
 from moto import mock_ec2
 
 from revel import MachineManager
+from revel.config import Disk, DiskType
+from revel.machine import MachineState
+from revel.providers.base import HIBERNATE_REASON, ProviderError
+from revel.providers.ec2 import EC2Provider
+from revel.providers.memory import InMemoryProvider
 
 
 @mock_ec2()
@@ -12,22 +17,112 @@ def test_machine_loop():
     name = "mock"
     machine_state_dir = Path("/tmp/")
     mm = MachineManager(
-        ec2=boto3.resource("ec2"), machine_state_dir=machine_state_dir, name=name
+        provider=EC2Provider(boto3.client("ec2")),
+        machine_state_dir=machine_state_dir,
+        name=name,
     )
 
     mm.create(
         ami="ami-123123123",
-        instance_type="t3.fake",
+        instance_type="t3.micro",
         key_name="gonzalopeci",
+        hibernate=True,
     )
 
+    mm.stop()
+    assert mm.machine.state == MachineState.STOPPED
+
+    mm.start()
+    assert mm.machine.state == MachineState.RUNNING
+
+    mm.suspend()
+    # moto stops without hibernating, the state follows the reported reason
+    assert mm.machine.state == MachineState.STOPPED
+
+    mm.start()
+    assert mm.machine.state == MachineState.RUNNING
+
     mm.destroy()
 
-    with pytest.raises(NotImplementedError):
-        mm.stop()
 
-        mm.start()
+def test_suspend_records_the_reported_state(tmp_path):
+    provider = InMemoryProvider()
+    mm = MachineManager(tmp_path, "default", provider)
+    mm.create(ami="ami-123", key_name="key", hibernate=True)
+    assert MachineManager(tmp_path, "default", provider).machine.hibernate
+
+    mm.suspend()
+    assert mm.machine.state == MachineState.SUSPENDED
+
+    mm.start()
+    stop = provider.stop
+    provider.stop = lambda ids, hibernate=False: stop(ids)
+    mm.suspend()
+    assert mm.machine.state == MachineState.STOPPED, "It was not hibernated"
+
 
+def test_suspend_refuses_machines_launched_without_hibernation(tmp_path):
+    provider = InMemoryProvider()
+    mm = MachineManager(tmp_path, "default", provider)
+    mm.create(ami="ami-123", key_name="key")
+
+    with pytest.raises(ValueError, match="not launched with hibernation"):
         mm.suspend()
+    assert provider.calls["stop"] == 0
+
+
+def test_hibernated_instance_state():
+    state = MachineState.from_instance_state("stopped", HIBERNATE_REASON)
+    assert state == MachineState.SUSPENDED
+
+    state = MachineState.from_instance_state("stopped", "Client.UserInitiatedShutdown")
+    assert state == MachineState.STOPPED
+
+
+@mock_ec2()
+def test_cache_volume_survives_destroy(tmp_path):
+    provider = EC2Provider(boto3.client("ec2"))
+    cache = Disk(type=DiskType.GP3, size=20, mount="/cache")
+    mm = MachineManager(provider=provider, machine_state_dir=tmp_path, name="cached")
+
+    machine = mm.create(ami="ami-123123123", key_name="gonzalopeci", cache=cache)
+    volume_id = machine.cache_volume_id
+    assert volume_id, "Cache volume should be tracked in the machine state"
+    assert provider.describe_volumes(ids=[volume_id])[0].attachments == [machine.id]
+
+    mm.destroy()
+    assert provider.describe_volumes(ids=[volume_id])[0].state == "available"
+
+    mm = MachineManager(provider=provider, machine_state_dir=tmp_path, name="cached")
+    machine = mm.create(ami="ami-123123123", key_name="gonzalopeci", cache=cache)
+    assert machine.cache_volume_id == volume_id, "Cache volume should be reused"
+    assert len(MachineManager.list_cache_volumes(provider)) == 1
+
+
+def test_cache_volumes_are_namespaced_by_state_dir(tmp_path):
+    provider = InMemoryProvider()
+    cache = Disk(type=DiskType.GP3, size=20, mount="/cache")
+
+    first = MachineManager(tmp_path / "alice", "default", provider)
+    second = MachineManager(tmp_path / "bob", "default", provider)
+    first.create(ami="ami-123", key_name="key", cache=cache)
+    second.create(ami="ami-123", key_name="key", cache=cache)
+
+    assert first.machine.cache_volume_id != second.machine.cache_volume_id
+    assert len(MachineManager.list_cache_volumes(provider)) == 2
+
+
+def test_failed_cache_attach_terminates_instance(tmp_path, monkeypatch):
+    provider = InMemoryProvider()
+    cache = Disk(type=DiskType.GP3, size=20, mount="/cache")
+    mm = MachineManager(tmp_path, "default", provider)
+
+    def attach_volume(volume_id, instance_id, device):
+        raise ProviderError("Volume is busy")
+
+    monkeypatch.setattr(provider, "attach_volume", attach_volume)
+    with pytest.raises(ProviderError):
+        mm.create(ami="ami-123", key_name="key", cache=cache)
 
-        mm.start()
+    assert [i.state for i in provider.instances.values()] == ["shutting-down"]
+    assert not (tmp_path / "default.yml").exists()
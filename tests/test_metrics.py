@@ -0,0 +1,49 @@
+from collections import Counter
+
+from revel import metrics
+
+
+def test_percentile_interpolates():
+    values = [1.0, 2.0, 3.0, 4.0, 5.0]
+
+    assert metrics.percentile(values, 0.5) == 3.0
+    assert metrics.percentile(values, 0.95) == 4.8
+    assert metrics.percentile([], 0.5) == 0.0
+
+
+def test_log_rotates_and_reads_oldest_first(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "MAX_BYTES", 200)
+    for n in range(20):
+        metrics.append(tmp_path, metrics.Record("start", f"machine-{n}", n, 1.0))
+
+    assert (tmp_path / ".metrics.jsonl.1").exists()
+    assert not (tmp_path / f".metrics.jsonl.{metrics.BACKUP_COUNT + 1}").exists()
+    records = metrics.read(tmp_path)
+    assert [r.started for r in records] == sorted(r.started for r in records)
+    assert records[-1].machine == "machine-19"
+    assert [r.started for r in metrics.read(tmp_path, since=18)] == [18, 19]
+
+
+def test_summarize_and_prometheus():
+    records = [
+        metrics.Record("create", "a", 0, duration=10.0, api_calls=4),
+        metrics.Record("create", "b", 0, duration=30.0, api_calls=6),
+        metrics.Record("sync", "a", 0, 2.0, bytes_synced=100, outcome=metrics.ERROR),
+        metrics.Record("sync", "missing", 0, 0.01, outcome=metrics.SKIPPED),
+    ]
+
+    assert metrics.summarize(records) == [
+        ["create", 2, 0, 20.0, 29.0, 29.8, 30.0, 5.0, 0],
+        ["sync", 1, 1, 2.0, 2.0, 2.0, 2.0, 0.0, 100],
+    ]
+
+    text = metrics.prometheus(records, Counter({"RUNNING": 2, "STOPPED": 1}))
+    assert 'revel_machines{state="running"} 2\n' in text
+    assert (
+        'revel_operation_duration_seconds{operation="create",quantile="0.95"} 29.000'
+        in text
+    )
+    assert 'revel_operations{operation="sync"} 1\n' in text
+    assert 'revel_operation_errors{operation="sync"} 1\n' in text
+    # Aggregates of the log window can go down, none is exported as a counter
+    assert "counter" not in text and "summary" not in text
@@ -0,0 +1,128 @@
+import time
+
+import pytest
+
+from revel import MachineManager
+from revel.config import Disk, DiskType
+from revel.machine import MachineState
+from revel.providers.base import InstanceSpec, ProviderError
+from revel.providers.ec2 import DEFAULT_IOPS, block_device
+from revel.providers.memory import InMemoryProvider
+
+
+def test_block_device():
+    gp3 = block_device("/dev/sda1", Disk(type=DiskType.GP3, size=20, throughput=250))
+    assert gp3["Ebs"]["VolumeType"] == "gp3"
+    assert gp3["Ebs"]["Throughput"] == 250
+    assert "Iops" not in gp3["Ebs"]
+
+    io1 = block_device("/dev/sdf", Disk(type=DiskType.IO1, size=100))
+    assert io1["Ebs"]["Iops"] == DEFAULT_IOPS, "io1 requires provisioned IOPS"
+
+    io1 = block_device("/dev/sdf", Disk(type=DiskType.IO1, size=10))
+    assert io1["Ebs"]["Iops"] == 500, "io1 allows at most 50 IOPS per GiB"
+
+    io2 = block_device("/dev/sdf", Disk(type=DiskType.IO2, size=4))
+    assert io2["Ebs"]["Iops"] == 2000, "io2 allows at most 500 IOPS per GiB"
+
+    io2 = block_device("/dev/sdf", Disk(type=DiskType.IO2, size=4, iops=1000))
+    assert io2["Ebs"]["Iops"] == 1000
+
+    gp2 = block_device("/dev/sdf", Disk(type=DiskType.GP2, size=20, iops=9000))
+    assert "Iops" not in gp2["Ebs"], "gp2 does not accept provisioned IOPS"
+
+
+def test_memory_provider_lifecycle():
+    provider = InMemoryProvider()
+    spec = InstanceSpec(
+        name="mock", image="ami-123", instance_type="t3.micro", key_name="key"
+    )
+    ids = [i.id for i in provider.create(spec, count=3)]
+
+    provider.wait(ids, "running")
+    provider.stop(ids[:1], hibernate=True)
+    provider.wait(ids[:1], "stopped")
+
+    states = {i.id: i.state for i in provider.describe(ids + ["i-missing"])}
+    assert states == {ids[0]: "stopped", ids[1]: "running", ids[2]: "running"}
+
+    with pytest.raises(ProviderError):
+        provider.wait(ids[:1], "running")
+
+
+def test_memory_provider_wait_takes_transition_latency():
+    provider = InMemoryProvider(latencies={"transition": 0.1})
+    spec = InstanceSpec(
+        name="mock", image="ami-123", instance_type="t3.micro", key_name="key"
+    )
+    ids = [i.id for i in provider.create(spec)]
+    assert provider.describe(ids)[0].state == "pending"
+
+    started = time.monotonic()
+    provider.wait(ids, "running")
+
+    assert time.monotonic() - started >= 0.09
+    assert provider.describe(ids)[0].state == "running"
+
+
+def test_fleet_operations_are_batched(tmp_path):
+    provider = InMemoryProvider()
+    for n in range(50):
+        MachineManager(tmp_path, f"machine-{n}", provider).create(
+            ami="ami-123", key_name="key", hibernate=True
+        )
+    provider.calls.clear()
+
+    managers = MachineManager.list(tmp_path, provider)
+    MachineManager.suspend_many(managers)
+    MachineManager.start_many(managers)
+
+    assert provider.calls["stop"] == 1
+    assert provider.calls["start"] == 1
+    assert provider.calls["describe"] == 2
+    assert {mm.machine.state for mm in managers} == {MachineState.RUNNING}
+
+    MachineManager.refresh_many(managers)
+    assert {mm.machine.state for mm in MachineManager.list(tmp_path, provider)} == {
+        MachineState.RUNNING
+    }
+
+
+def test_fleet_operations_skip_missing_instances(tmp_path):
+    provider = InMemoryProvider()
+    for name in ["alpha", "beta"]:
+        MachineManager(tmp_path, name, provider).create(ami="ami-123", key_name="key")
+    # Saved before a create that failed to launch
+    MachineManager(tmp_path, "failed", provider).save()
+    # Deleted outside revel
+    beta = MachineManager(tmp_path, "beta", provider)
+    del provider.instances[beta.machine.id]
+
+    managers = MachineManager.list(tmp_path, provider)
+    MachineManager.stop_many(managers)
+    MachineManager.start_many(managers)
+    MachineManager.refresh_many(managers)
+
+    states = {mm.machine.name: mm.machine.state for mm in managers}
+    assert states == {
+        "alpha": MachineState.RUNNING,
+        "beta": MachineState.TERMINATED,
+        "failed": MachineState.CREATING,
+    }
+
+
+def test_wake_refreshes_public_ip(tmp_path):
+    provider = InMemoryProvider(latencies={"transition": 0.05})
+    mm = MachineManager(tmp_path, "default", provider)
+    mm.create(ami="ami-123", key_name="key", hibernate=True)
+    ip = mm.machine.public_ip_address
+    mm.suspend()
+
+    progress = []
+    machine = mm.wake(progress=progress.append, poll=0.01)
+
+    assert machine.state == MachineState.RUNNING
+    assert machine.public_ip_address not in [None, ip]
+    assert progress[0] == "Instance default is pending"
+    # Polls describe rather than waiting for the status checks
+    assert provider.calls["wait"] == 2
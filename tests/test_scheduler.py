@@ -0,0 +1,58 @@
+import threading
+import time
+
+import pytest
+
+from revel import scheduler
+from revel.config import InitStep
+
+
+def test_independent_steps_overlap():
+    steps = [
+        InitStep(id="a", action="a"),
+        InitStep(id="b", action="b", needs=["a"]),
+        InitStep(id="c", action="c", needs=["a"]),
+        InitStep(id="d", action="d", needs=["b", "c"]),
+    ]
+    events = []
+    lock = threading.Lock()
+
+    def execute(step: InitStep) -> None:
+        with lock:
+            events.append(f"start {step.id}")
+        time.sleep(0.05)
+        with lock:
+            events.append(f"end {step.id}")
+
+    scheduler.run(steps, execute, jobs=2)
+
+    assert events[0:2] == ["start a", "end a"]
+    assert set(events[2:4]) == {"start b", "start c"}, "b and c should overlap"
+    assert events[-2:] == ["start d", "end d"]
+
+
+def test_failure_stops_scheduling():
+    steps = [
+        InitStep(id="a", action="a"),
+        InitStep(id="b", action="b", needs=["a"]),
+    ]
+    executed = []
+
+    def execute(step: InitStep) -> None:
+        executed.append(step.id)
+        raise RuntimeError(step.id)
+
+    with pytest.raises(RuntimeError):
+        scheduler.run(steps, execute, jobs=2)
+
+    assert executed == ["a"]
+
+
+def test_circular_needs():
+    steps = [
+        InitStep(id="a", action="a", needs=["b"]),
+        InitStep(id="b", action="b", needs=["a"]),
+    ]
+
+    with pytest.raises(ValueError):
+        scheduler.order(steps)
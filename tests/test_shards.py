@@ -0,0 +1,65 @@
+from revel import shards
+
+
+def test_scan(tmp_path):
+    (tmp_path / "src").mkdir()
+    (tmp_path / "src" / "main.py").write_text("print()\n")
+    (tmp_path / "empty").mkdir()
+    (tmp_path / "README.md").write_text("")
+
+    assert sorted(shards.scan(tmp_path)) == [
+        ("README.md", 0),
+        ("empty", 0),
+        ("src/main.py", 8),
+    ]
+
+
+def test_scan_lists_symlinked_directories(tmp_path):
+    (tmp_path / "pkg").mkdir()
+    (tmp_path / "pkg" / "index.js").write_text("")
+    (tmp_path / "node_modules").mkdir()
+    (tmp_path / "node_modules" / "pkg").symlink_to("../pkg")
+
+    names = [name for name, _ in shards.scan(tmp_path)]
+    assert sorted(names) == ["node_modules/pkg", "pkg/index.js"]
+
+
+class FakeClient:
+    def __init__(self):
+        self.synced = []
+        self.commands = []
+
+    def sync(self, src, dst, opts=None, foreground=True):
+        self.synced.append((src, dst))
+        return lambda **kwargs: None
+
+    def run(self, args, foreground=True):
+        self.commands.append(args)
+        return lambda: None
+
+
+def test_upload_targets_the_source_name_like_a_plain_sync(tmp_path):
+    client = FakeClient()
+    files = shards.split([("a", 1), ("b", 1)], 2)
+    status = shards.upload(client, f"{tmp_path}/code/", "/home/ubuntu", files)
+
+    assert status == 0
+    assert client.commands == [["mkdir", "-p", "/home/ubuntu/code"]]
+    assert client.synced == [(f"{tmp_path}/code/", "/home/ubuntu/code")] * 2
+
+
+def test_split_balances_size_and_count():
+    files = [("large", 1000)] + [(f"small-{n}", 10) for n in range(100)]
+    result = shards.split(files, 2, file_cost=10)
+
+    assert len(result) == 2
+    assert sum(shard.size for shard in result) == 2000
+    # The large file is balanced by more small files, weighed by their count
+    assert sorted(len(shard.files) for shard in result) == [26, 75]
+    weights = [shard.weight for shard in result]
+    assert max(weights) - min(weights) <= 20
+
+
+def test_split_never_returns_empty_shards():
+    assert len(shards.split([("a", 1)], 4)) == 1
+    assert shards.split([], 4) == []
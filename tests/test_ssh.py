@@ -0,0 +1,86 @@
+import shlex
+from pathlib import Path
+
+from revel.providers import ssh
+
+
+def test_merge_config_replaces_and_appends():
+    existing = "\n".join(
+        [
+            ssh.host_config("foo.revel", user="ubuntu", hostname="1.1.1.1"),
+            ssh.host_config("other", user="root", hostname="2.2.2.2"),
+        ]
+    )
+    stanzas = {
+        "foo.revel": ssh.host_config("foo.revel", user="ubuntu", hostname="3.3.3.3"),
+        "bar.revel": ssh.host_config("bar.revel", user="ubuntu", hostname="4.4.4.4"),
+    }
+
+    result = ssh.merge_config(existing, stanzas)
+
+    assert "1.1.1.1" not in result
+    assert result.index("foo.revel") < result.index("Host other")
+    assert result.index("Host other") < result.index("bar.revel")
+    assert ssh.merge_config(result, stanzas) == result, "Merge should be idempotent"
+
+
+def test_merge_config_prunes_stale_hosts():
+    existing = "\n".join(
+        [
+            ssh.host_config("gone.revel", user="ubuntu", hostname="1.1.1.1"),
+            ssh.host_config("other", user="root", hostname="2.2.2.2"),
+        ]
+    )
+    stanzas = {
+        "foo.revel": ssh.host_config("foo.revel", user="ubuntu", hostname="3.3.3.3"),
+    }
+
+    result = ssh.merge_config(existing, stanzas, prune_suffix=".revel")
+
+    assert "gone.revel" not in result
+    assert "Host other" in result
+    assert "Host foo.revel" in result
+
+
+def test_host_config_options():
+    result = ssh.host_config(
+        "foo.revel",
+        user="ubuntu",
+        hostname="1.1.1.1",
+        multiplex=True,
+        compression=True,
+    )
+
+    assert "ControlMaster auto" in result
+    assert "Compression yes" in result
+
+
+def test_pin_host_keys(tmp_path):
+    known_hosts = tmp_path / "known_hosts"
+    known_hosts.write_text("1.1.1.1 ssh-ed25519 OLD\n2.2.2.2 ssh-ed25519 OTHER\n")
+
+    assert ssh.pin_host_keys(known_hosts, "1.1.1.1", "1.1.1.1 ssh-ed25519 NEW\n")
+    assert not ssh.pin_host_keys(known_hosts, "1.1.1.1", "1.1.1.1 ssh-ed25519 NEW\n")
+
+    content = known_hosts.read_text()
+    assert "OLD" not in content
+    assert "OTHER" in content
+    assert "NEW" in content
+
+
+def test_pull_command(monkeypatch, fake_commands):
+    monkeypatch.setattr(ssh, "scan_host_keys", lambda host: "")
+    client = ssh.SSH("ubuntu", "1.1.1.1", multiplex=True)
+
+    command = client.pull(
+        "/var/log/bench", "~/logs", opts=["--archive"], foreground=False
+    )
+    args = str(command()).splitlines()
+
+    assert args[:3] == ["rsync", "-e", shlex.join(["ssh", *client.options()])]
+    # Remote source first, local destination last
+    assert args[3:] == [
+        "--archive",
+        "ubuntu@1.1.1.1:/var/log/bench",
+        str(Path("~/logs").expanduser()),
+    ]
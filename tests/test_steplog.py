@@ -0,0 +1,48 @@
+import pytest
+
+from revel import steplog
+
+
+class StepFailed(Exception):
+    exit_code = 3
+
+
+def test_step_logs_are_bounded(tmp_path):
+    run_log = steplog.RunLog(tmp_path, "default", max_bytes=100)
+    with run_log.step("build") as log:
+        for n in range(30):
+            log.write(f"line {n}\n")
+
+    path = steplog.step_path(tmp_path, "default", "build")
+    assert path.stat().st_size <= 100
+    assert steplog.tail(path, 2) == ["line 28", "line 29"]
+    assert log.last_line == "line 29"
+    assert steplog.read_run(tmp_path, "default")["build"]["status"] == steplog.OK
+
+
+def test_failed_steps_are_recorded(tmp_path):
+    run_log = steplog.RunLog(tmp_path, "default")
+    with pytest.raises(StepFailed):
+        with run_log.step("test") as log:
+            log.write("FAIL: test_something\n")
+            raise StepFailed()
+
+    assert [log.exit_code for log in run_log.failed()] == [3]
+    assert steplog.read_run(tmp_path, "default")["test"]["exit_code"] == 3
+
+    # A new run replaces the logs of the previous one
+    steplog.RunLog(tmp_path, "default")
+    assert steplog.read_run(tmp_path, "default") == {}
+    assert not steplog.step_path(tmp_path, "default", "test").exists()
+
+
+def test_status_board_reports_transitions(tmp_path, capsys):
+    run_log = steplog.RunLog(tmp_path, "default")
+    with steplog.StatusBoard(run_log, interval=60, live=False) as board:
+        with run_log.step("update"):
+            board.render()
+
+    assert capsys.readouterr().out.splitlines() == [
+        "- update running 0.0s",
+        "✔ update ok 0.0s",
+    ]